@@ -3,6 +3,15 @@ from fastapi import FastAPI
 
 from app.config import config_manager, get_config
 from app.services.database import sessionmanager
+from app.services.cache import principal_cache, role_cache, token_cache
+from app.services.invalidation import invalidation_bus
+from app.services.keys import keyring
+from app.services.metrics import InstrumentationMiddleware, instrument_engine, metrics_registry
+from app.services.password import password_hasher
+from app.services.ratelimit import login_limiter
+from app.services.revocation import load_revocations
+from app.services.slow_queries import slow_query_log
+from app.services.tracing import TracingMiddleware, trace_engine, tracer
 
 
 def init_app(config_file: str = 'config.json'):
@@ -11,17 +20,40 @@ def init_app(config_file: str = 'config.json'):
     config_manager.init(config_file)
     config = get_config()
 
-    sessionmanager.init(config['db_url'], config['config_name'])
+    sessionmanager.init(config['db_url'], config['config_name'], config.get('db_pool'),
+                        replicas=config.get('db_replica_urls'),
+                        replica_strategy=config.get('db_replica_strategy', 'round_robin'))
+    slow_query_log.configure(**config.get('slow_query_log', {}))
+    for engine in sessionmanager.engines():
+        instrument_engine(engine)
+        trace_engine(engine)
+        slow_query_log.watch(engine)
+    metrics_registry.configure(**config.get('metrics', {}))
+    tracer.configure(**config.get('tracing', {}))
+    password_hasher.init(**config.get('password_hashing', {}))
+    login_limiter.configure(**config.get('login_rate_limit', {}))
+    keyring.configure(config.get('secret_key'), config.get('algorithm', 'HS256'), **config.get('token_keys', {}))
+    principal_cache.configure(**config.get('principal_cache', {}))
+    token_cache.configure(**config.get('token_cache', {}))
+    role_cache.configure(**config.get('role_cache', {}))
+    invalidation_bus.configure(config['db_url'], **config.get('cache_invalidation', {}))
 
     @ asynccontextmanager
     async def lifespan(app: FastAPI):
+        await invalidation_bus.start()
+        await load_revocations()
         yield
+        await invalidation_bus.stop()
+        await slow_query_log.close()
+        password_hasher.close()
         if sessionmanager._engine is not None:
             await sessionmanager.close()
 
     server = FastAPI(title="AssumptionBook", lifespan=lifespan)
     if config['config_name'] == "testing":
         server.title = "testing"
+    server.add_middleware(InstrumentationMiddleware)
+    server.add_middleware(TracingMiddleware)
 
     from app.views.auth import router as auth_router
     server.include_router(auth_router, prefix="/api", tags=["auth"])
@@ -32,4 +64,7 @@ def init_app(config_file: str = 'config.json'):
     from app.views.roles import router as role_router
     server.include_router(role_router, prefix="/api", tags=["roles"])
 
+    from app.views.stats import router as stats_router
+    server.include_router(stats_router, prefix="/api", tags=["stats"])
+
     return server
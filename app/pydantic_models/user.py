@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from pydantic import EmailStr
 from pydantic.types import UUID4
@@ -22,17 +22,31 @@ class UserCreate(UserBase):
 
 class User(UserBase):
     id: int
-    uuid: str
+    uuid: UUID4
 
     class Config:
         from_attributes = True
 
 
+class BulkUserResult(BaseModel):
+    index: int
+    user: User | None = None
+    detail: str | None = None
+
+
 class UserInDB(User):
     password: str
     disabled: bool = True
 
 
+class CurrentUser(User):
+    disabled: bool = True
+
+    class Config:
+        from_attributes = True
+        frozen = True
+
+
 class RoleBase(BaseModel):
     name: str
     description: str | None = None
@@ -49,7 +63,7 @@ class RoleCreate(RoleBase):
 
 class Role(RoleBase):
     id: int
-    uuid: str
+    uuid: UUID4
 
     class Config:
         from_attributes = True
@@ -65,3 +79,17 @@ class RoleWithUsers(Role):
 
 class UserWithRoles(User):
     roles: list["Role"] = []
+
+
+class UserIds(BaseModel):
+    user_ids: list[int] = Field(max_length=1000)
+
+
+class RoleIds(BaseModel):
+    role_ids: list[int] = Field(max_length=1000)
+
+
+class RoleAssignment(BaseModel):
+    user_id: int
+    role_id: int
+    detail: str
@@ -0,0 +1,237 @@
+import hashlib
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Hashable
+
+from app.services.invalidation import invalidation_bus, USER, ROLES, RESET
+from app.services.keys import keyring
+
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire after a time to live.
+
+    Meant for a single event loop, so there is no locking. A max_size of 0
+    disables the cache: set() becomes a no-op and every get() misses.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 30):
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.configure(max_size, ttl_seconds)
+
+    def configure(self, max_size: int = 1024, ttl_seconds: float = 30):
+        self._max_size = max_size
+        self._ttl = ttl_seconds
+        self.clear()
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @property
+    def ttl_seconds(self) -> float:
+        return self._ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: float | None = None):
+        if self._max_size <= 0:
+            return
+        ttl = self._ttl if ttl_seconds is None else min(ttl_seconds, self._ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry is not None else None
+
+    def items(self):
+        now = time.monotonic()
+        return [(key, value) for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class PrincipalCache:
+    """Authenticated users keyed by username (the JWT subject).
+
+    Writes to a user only know the user id, so an id -> username index is kept
+    next to the cache for invalidate().
+
+    get() also returns the cache's generation, which every invalidation
+    bumps. A miss hands it back to put(), which skips the write when an
+    invalidation arrived while the user was being loaded, since the loaded
+    row may predate it.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache()
+        self._usernames: dict[int, str] = {}
+        self._generation = 0
+
+    def configure(self, max_size: int = 1024, ttl_seconds: float = 30):
+        self._cache.configure(max_size, ttl_seconds)
+        self._usernames.clear()
+        self._generation += 1
+
+    def get(self, username: str) -> tuple[Any, int]:
+        return self._cache.get(username), self._generation
+
+    def put(self, principal, generation: int):
+        if generation != self._generation:
+            return
+        self._cache.set(principal.username, principal)
+        self._usernames[principal.id] = principal.username
+        if len(self._usernames) > 2 * max(self._cache.max_size, 1):
+            # Drop index entries of principals the LRU already evicted
+            self._usernames = {value.id: key for key, value in self._cache.items()}
+
+    def invalidate(self, user_id: int):
+        # Also when the user is not cached, a load of it may be in flight
+        self._generation += 1
+        username = self._usernames.pop(user_id, None)
+        if username is not None:
+            self._cache.pop(username)
+
+    def clear(self):
+        self._generation += 1
+        self._cache.clear()
+        self._usernames.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+class TokenCache:
+    """Claims of bearer tokens whose signature was already verified.
+
+    Keys are SHA-256 digests so raw tokens are not kept in memory. An entry
+    never outlives the token's exp claim, and tokens without exp are not
+    cached. Hits and misses are also counted per route, and the average
+    decode time of the misses gives an estimate of the time the hits saved.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(4096, 300)
+        self._decodes = 0
+        self._decode_seconds = 0.0
+        self._routes: defaultdict[str, dict] = defaultdict(lambda: {"hits": 0, "misses": 0})
+
+    def configure(self, max_size: int = 4096, ttl_seconds: float = 300):
+        self._cache.configure(max_size, ttl_seconds)
+        self._decodes = 0
+        self._decode_seconds = 0.0
+        self._routes.clear()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str, route: str | None = None) -> dict | None:
+        claims = self._cache.get(self._key(token))
+        if route is not None:
+            self._routes[route]["hits" if claims is not None else "misses"] += 1
+        return claims
+
+    def put(self, token: str, claims: dict, decode_seconds: float = 0.0):
+        self._decodes += 1
+        self._decode_seconds += decode_seconds
+        expires_at = claims.get("exp")
+        if isinstance(expires_at, (int, float)):
+            self._cache.set(self._key(token), claims, expires_at - time.time())
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        stats = self._cache.stats()
+        average_decode = self._decode_seconds / self._decodes if self._decodes else 0.0
+        stats.update({
+            "average_decode_seconds": average_decode,
+            "decode_seconds_saved": average_decode * stats["hits"],
+            "routes": {route: dict(counts) for route, counts in self._routes.items()},
+        })
+        return stats
+
+
+class RoleCache:
+    """Role names per user id for authorization checks.
+
+    Values are frozensets, so a check is a subset test. Renaming or deleting
+    a role touches every member, so those clear the whole cache instead.
+    Loads are guarded by a generation as in PrincipalCache.
+    """
+
+    def __init__(self):
+        self._cache = TTLCache(4096, 60)
+        self._generation = 0
+
+    def configure(self, max_size: int = 4096, ttl_seconds: float = 60):
+        self._cache.configure(max_size, ttl_seconds)
+        self._generation += 1
+
+    def get(self, user_id: int) -> tuple[frozenset[str] | None, int]:
+        return self._cache.get(user_id), self._generation
+
+    def put(self, user_id: int, role_names: frozenset[str], generation: int):
+        if generation == self._generation:
+            self._cache.set(user_id, role_names)
+
+    def invalidate(self, user_id: int):
+        self._generation += 1
+        self._cache.pop(user_id)
+
+    def clear(self):
+        self._generation += 1
+        self._cache.clear()
+
+    def stats(self) -> dict:
+        return self._cache.stats()
+
+
+principal_cache = PrincipalCache()
+token_cache = TokenCache()
+role_cache = RoleCache()
+
+
+def clear_caches(_=None):
+    principal_cache.clear()
+    role_cache.clear()
+
+
+# Writes publish on the bus, on this worker and on every other one
+invalidation_bus.subscribe(USER, principal_cache.invalidate)
+invalidation_bus.subscribe(USER, role_cache.invalidate)
+invalidation_bus.subscribe(ROLES, lambda _: role_cache.clear())
+invalidation_bus.subscribe(RESET, clear_caches)
+# Tokens verified with a key that was removed must be decoded again
+keyring.subscribe(token_cache.clear)
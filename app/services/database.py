@@ -1,16 +1,26 @@
 import contextlib
+import itertools
+import time
 from typing import AsyncIterator
 from fastapi import Depends
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import (
     AsyncConnection, AsyncEngine, AsyncSession,
     async_sessionmaker, create_async_engine
 )
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.util.queue import AsyncAdaptedQueue, Empty
 from sqlalchemy.orm import Mapped, mapped_column, declarative_base
-from sqlalchemy import Column, String, Integer, DateTime
+from sqlalchemy import Column, String, Integer, DateTime, Uuid
 from sqlalchemy_utc import UtcDateTime, utcnow
 from sqlalchemy.sql import func
 from datetime import datetime
 from typing import Optional
+from uuid import UUID, uuid4
+
+from app.services.tracing import tracer
 
 Base = declarative_base()
 
@@ -27,7 +37,112 @@ class SubBaseEntity(Base):
 
 class BaseEntity(SubBaseEntity):
     __abstract__ = True
-    uuid: Mapped[Optional[str]] = mapped_column(String, unique=True)
+    # Native uuid on PostgreSQL, CHAR(32) hex on databases without one (SQLite)
+    uuid: Mapped[Optional[UUID]] = mapped_column(Uuid, unique=True, default=uuid4)
+
+
+class WaitTimingQueue(AsyncAdaptedQueue):
+    """Connection queue that records the checkouts that had to wait.
+
+    A checkout waits only when no connection is idle and no overflow slot is
+    left, until another checkout returns its connection. Checkouts served at
+    once and those that open a new connection are not counted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_count = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def get(self, block: bool = True, timeout: float | None = None):
+        try:
+            return self.get_nowait()
+        except Empty:
+            if not block:
+                raise
+
+        start = time.perf_counter()
+        try:
+            return super().get(block, timeout)
+        finally:
+            waited = time.perf_counter() - start
+            self.wait_count += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait for a connection."""
+    _queue_class = WaitTimingQueue
+
+    @property
+    def wait_count(self) -> int:
+        return self._pool.wait_count
+
+    @property
+    def wait_seconds(self) -> float:
+        return self._pool.wait_seconds
+
+    @property
+    def max_wait_seconds(self) -> float:
+        return self._pool.max_wait_seconds
+
+
+POOL_OPTIONS = ("pool_size", "max_overflow", "pool_pre_ping", "pool_recycle", "pool_timeout")
+
+
+def engine_options(host: str, pool: dict | None = None) -> tuple[URL | str, dict]:
+    """Translate the db_pool config section into create_async_engine arguments.
+
+    statement_cache_size (asyncpg's own cache) and prepared_statement_cache_size
+    (SQLAlchemy's asyncpg adapter cache) only apply to asyncpg and are ignored
+    for other drivers.
+    """
+    pool = dict(pool or {})
+    url = make_url(host)
+    options = {}
+
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In memory databases live in a single connection, leave the default pool
+        return host, options
+
+    options["poolclass"] = InstrumentedQueuePool
+    for name in POOL_OPTIONS:
+        if name in pool:
+            options[name] = pool.pop(name)
+
+    statement_cache_size = pool.pop("statement_cache_size", None)
+    prepared_statement_cache_size = pool.pop("prepared_statement_cache_size", None)
+    if url.get_driver_name() == "asyncpg":
+        if statement_cache_size is not None:
+            options["connect_args"] = {"statement_cache_size": statement_cache_size}
+        if prepared_statement_cache_size is not None:
+            url = url.update_query_dict(
+                {"prepared_statement_cache_size": str(prepared_statement_cache_size)})
+
+    if pool:
+        raise ValueError(f"Unknown db_pool options: {', '.join(sorted(pool))}")
+    return url, options
+
+
+def pool_stats(engine: AsyncEngine) -> dict:
+    pool = engine.pool
+    stats = {"pool": pool.__class__.__name__, "status": pool.status()}
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "wait_count": pool.wait_count,
+            "wait_seconds": pool.wait_seconds,
+            "max_wait_seconds": pool.max_wait_seconds,
+        })
+    return stats
+
+
+REPLICA_STRATEGIES = ("round_robin", "least_connections")
 
 
 class DatabaseSessionManager:
@@ -35,24 +150,69 @@ class DatabaseSessionManager:
         self._init_done = False
         self._engine: AsyncEngine | None = None
         self._sessionmaker: async_sessionmaker | None = None
+        self._replica_engines: list[AsyncEngine] = []
+        self._replica_sessionmakers: list[async_sessionmaker] = []
+        self._replica_down_until: list[float] = []
+
+    def init(self, host: str, comment: str = None, pool: dict | None = None,
+             replicas: list[str] | None = None, replica_strategy: str = "round_robin",
+             replica_retry_seconds: float = 30):
+        if replica_strategy not in REPLICA_STRATEGIES:
+            raise ValueError(f"Unknown replica strategy '{replica_strategy}'")
 
-    def init(self, host: str, comment: str = None):
         self._comment = comment
-        self._engine = create_async_engine(host)
+        url, options = engine_options(host, pool)
+        self._engine = create_async_engine(url, **options)
+        # Writes return server generated columns with RETURNING, so instances
+        # stay loaded after commit instead of being expired and refreshed
         self._sessionmaker = async_sessionmaker(
-            autocommit=False, bind=self._engine)
+            autocommit=False, expire_on_commit=False, bind=self._engine)
+
+        self._replica_engines = []
+        for replica in replicas or []:
+            url, options = engine_options(replica, pool)
+            self._replica_engines.append(create_async_engine(url, **options))
+        self._replica_sessionmakers = [
+            async_sessionmaker(autocommit=False, expire_on_commit=False, bind=engine)
+            for engine in self._replica_engines]
+        self._replica_down_until = [0.0] * len(self._replica_engines)
+        self._replica_cycle = itertools.cycle(range(len(self._replica_engines)))
+        self._replica_strategy = replica_strategy
+        self._replica_retry_seconds = replica_retry_seconds
         self._init_done = True
 
     def init_done(self):
         return self._init_done
 
+    def engines(self) -> list[AsyncEngine]:
+        """The primary engine followed by the replica engines."""
+        if self._engine is None:
+            raise RuntimeError("DatabaseSessionManager is not initialized")
+        return [self._engine, *self._replica_engines]
+
+    def pool_stats(self) -> dict:
+        if self._engine is None:
+            raise RuntimeError("DatabaseSessionManager is not initialized")
+
+        stats = pool_stats(self._engine)
+        stats["replicas"] = [
+            dict(pool_stats(engine), available=self._replica_down_until[index] <= time.monotonic())
+            for index, engine in enumerate(self._replica_engines)
+        ]
+        return stats
+
     async def close(self):
         if self._engine is None:
             raise RuntimeError("DatabaseSessionManager is not initialized")
 
         await self._engine.dispose()
+        for engine in self._replica_engines:
+            await engine.dispose()
         self._engine = None
         self._sessionmaker = None
+        self._replica_engines = []
+        self._replica_sessionmakers = []
+        self._replica_down_until = []
 
     @contextlib.asynccontextmanager
     async def connect(self) -> AsyncIterator[AsyncConnection]:
@@ -73,14 +233,70 @@ class DatabaseSessionManager:
             raise RuntimeError(
                 "Session: DatabaseSessionManager is not initialized")
 
+        # Not made current: the session outlives the request handler when it
+        # comes from a dependency, the span only measures open to close
+        span = tracer.start_span("session", **{"db.replica": False})
         session = self._sessionmaker()
         try:
             yield session
-        except Exception:
+        except Exception as exception:
+            span.record_exception(exception)
             await session.rollback()
             raise
         finally:
             await session.close()
+            span.end()
+
+    def _read_candidates(self) -> list[int]:
+        """Indexes of the replicas to try for a read, best first."""
+        now = time.monotonic()
+        available = [index for index, down_until in enumerate(self._replica_down_until)
+                     if down_until <= now]
+        if not available:
+            return []
+        if self._replica_strategy == "least_connections":
+            return sorted(available, key=lambda index: self._replica_engines[index].pool.checkedout())
+        first = next(self._replica_cycle)
+        return sorted(available, key=lambda index: (index - first) % len(self._replica_down_until))
+
+    @contextlib.asynccontextmanager
+    async def read_session(self) -> AsyncIterator[AsyncSession]:
+        """Session for read only work on a replica, or on the primary when
+        no replica is configured or reachable.
+
+        A replica that fails to hand out a connection is skipped for
+        replica_retry_seconds.
+        """
+        if self._sessionmaker is None:
+            raise RuntimeError(
+                "Session: DatabaseSessionManager is not initialized")
+
+        span = tracer.start_span("read_session")
+        session = None
+        for index in self._read_candidates():
+            candidate = self._replica_sessionmakers[index]()
+            try:
+                await candidate.connection()
+            except (DBAPIError, OSError):
+                await candidate.close()
+                self._replica_down_until[index] = time.monotonic() + self._replica_retry_seconds
+                continue
+            session = candidate
+            span.set_attribute("db.replica", index)
+            break
+        if session is None:
+            session = self._sessionmaker()
+            span.set_attribute("db.replica", False)
+
+        try:
+            yield session
+        except Exception as exception:
+            span.record_exception(exception)
+            await session.rollback()
+            raise
+        finally:
+            await session.close()
+            span.end()
 
     # Used for testing
 
@@ -94,6 +310,21 @@ class DatabaseSessionManager:
 sessionmanager = DatabaseSessionManager()
 
 
+def dialect_insert(db: AsyncSession, table):
+    """INSERT construct of the session's dialect, for ON CONFLICT clauses."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    raise NotImplementedError(f"INSERT ... ON CONFLICT is not supported for {dialect}")
+
+
 async def get_db():
     async with sessionmanager.session() as session:
         yield session
+
+
+async def get_db_read():
+    async with sessionmanager.read_session() as session:
+        yield session
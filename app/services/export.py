@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+
+EXPORT_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+async def ndjson_chunks(rows: AsyncIterator[dict], chunk_size: int = 500) -> AsyncIterator[str]:
+    """One JSON document per line, sent chunk_size rows at a time."""
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(row, default=str))
+        if len(lines) >= chunk_size:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+async def csv_chunks(rows: AsyncIterator[dict], fields: list[str], chunk_size: int = 500) -> AsyncIterator[str]:
+    """CSV with a header line. List values are joined with ';'."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    count = 0
+    async for row in rows:
+        writer.writerow({key: ";".join(value) if isinstance(value, list) else value
+                         for key, value in row.items()})
+        count += 1
+        if count >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_chunks(rows: AsyncIterator[dict], format: str, fields: list[str]) -> AsyncIterator[str]:
+    if format == "csv":
+        return csv_chunks(rows, fields)
+    return ndjson_chunks(rows)
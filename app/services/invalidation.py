@@ -0,0 +1,228 @@
+import asyncio
+import contextlib
+import json
+import logging
+import uuid
+from collections import defaultdict
+from typing import Any, Callable
+
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+# Message kinds. USER carries a user id, ROLES means any role may have been
+# renamed or deleted. TOKEN carries [jti, expires_at] of a revoked token and
+# USER_TOKENS [user_id, issued_before, expires_at] of revoked user tokens.
+# RESET is dispatched by a worker to itself when it may have missed
+# messages (for example after a reconnect), and sent in place of the
+# messages a worker had to drop.
+USER = "user"
+ROLES = "roles"
+TOKEN = "token"
+USER_TOKENS = "user_tokens"
+RESET = "reset"
+
+
+class MemoryBackend:
+    """Delivers messages to every bus attached to the same named broker in
+    this process. Stands in for a shared channel in tests."""
+
+    _brokers: defaultdict[str, list["InvalidationBus"]] = defaultdict(list)
+
+    def __init__(self, bus: "InvalidationBus", broker: str = "default"):
+        self._bus = bus
+        self._peers = self._brokers[broker]
+        self._peers.append(bus)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self.detach()
+
+    def detach(self):
+        if self._bus in self._peers:
+            self._peers.remove(self._bus)
+
+    def send(self, payload: str):
+        for peer in list(self._peers):
+            peer.receive(payload)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "connected": True}
+
+
+class PostgresBackend:
+    """LISTEN/NOTIFY on one dedicated asyncpg connection.
+
+    Messages are sent in order by a background task, so publishing never
+    waits on the network. When the connection drops the bus resets its
+    caches, since notifications sent in the meantime are lost, and the
+    connection is retried every retry_seconds. At most max_queued messages
+    wait for the connection. Past that they are dropped and replaced by a
+    single RESET, which clears the other workers' caches as a reconnect
+    clears this one's.
+    """
+
+    def __init__(self, bus: "InvalidationBus", db_url: str, channel: str = "cache_invalidation",
+                 retry_seconds: float = 5, max_queued: int = 1000):
+        url = make_url(db_url)
+        if url.get_backend_name() != "postgresql":
+            raise ValueError("The postgres cache invalidation backend needs a PostgreSQL db_url")
+        self._bus = bus
+        self._dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self._channel = channel
+        self._retry_seconds = retry_seconds
+        self._connection = None
+        self._queue: asyncio.Queue[str | None] = asyncio.Queue(max_queued)
+        self._task: asyncio.Task | None = None
+        self._dropped = 0
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self._close()
+
+    def send(self, payload: str):
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                if self._queue.get_nowait() is not None:
+                    self._dropped += 1
+            self._dropped += 1
+            self._queue.put_nowait(self._bus.payload(RESET))
+
+    async def _connect(self):
+        import asyncpg
+
+        connection = await asyncpg.connect(self._dsn)
+        try:
+            await connection.add_listener(self._channel, self._notified)
+        except BaseException:
+            connection.terminate()
+            raise
+        connection.add_termination_listener(lambda _: self._disconnected())
+        self._connection = connection
+        # Anything sent while this worker was not listening was missed
+        self._bus.receive_reset()
+
+    async def _close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None and not connection.is_closed():
+            try:
+                await connection.close(timeout=self._retry_seconds)
+            except Exception:
+                # A broken connection may not close cleanly, terminate() always does
+                connection.terminate()
+
+    def _notified(self, connection, pid, channel, payload):
+        self._bus.receive(payload)
+
+    def _disconnected(self):
+        self._connection = None
+        # Wake the sender so that it reconnects without waiting for a message.
+        # A full queue wakes it anyway.
+        if not self._queue.full():
+            self._queue.put_nowait(None)
+
+    async def _run(self):
+        payload = None
+        while True:
+            try:
+                if self._connection is None:
+                    await self._connect()
+                if payload is None:
+                    payload = await self._queue.get()
+                if payload is not None and self._connection is not None:
+                    await self._connection.execute("SELECT pg_notify($1, $2)", self._channel, payload)
+                    payload = None
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cache invalidation channel failed, retrying in %ss", self._retry_seconds)
+                try:
+                    await self._close()
+                finally:
+                    await asyncio.sleep(self._retry_seconds)
+
+    def stats(self) -> dict:
+        return {"backend": "postgres", "connected": self._connection is not None,
+                "queued": self._queue.qsize(), "dropped": self._dropped}
+
+
+class InvalidationBus:
+    """Fans cache invalidations out to every worker.
+
+    publish() applies an invalidation to this worker's subscribers right
+    away and sends it to the other workers through the backend. Messages
+    carry the sending bus's origin id so a worker skips its own.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self._handlers: defaultdict[str, list[Callable[[Any], None]]] = defaultdict(list)
+        self._backend = None
+        self._published = 0
+        self._received = 0
+
+    def configure(self, db_url: str | None = None, backend: str = "memory", **options):
+        if isinstance(self._backend, MemoryBackend):
+            self._backend.detach()
+        if backend == "memory":
+            self._backend = MemoryBackend(self, **options)
+        elif backend == "postgres":
+            self._backend = PostgresBackend(self, db_url, **options)
+        else:
+            raise ValueError(f"Unknown cache invalidation backend '{backend}'")
+        self._published = 0
+        self._received = 0
+
+    async def start(self):
+        if self._backend is not None:
+            await self._backend.start()
+
+    async def stop(self):
+        if self._backend is not None:
+            await self._backend.stop()
+
+    def subscribe(self, kind: str, handler: Callable[[Any], None]):
+        self._handlers[kind].append(handler)
+
+    def publish(self, kind: str, key: Any = None):
+        self._dispatch(kind, key)
+        self._published += 1
+        if self._backend is not None:
+            self._backend.send(self.payload(kind, key))
+
+    def payload(self, kind: str, key: Any = None) -> str:
+        return json.dumps({"origin": self.origin, "kind": kind, "key": key})
+
+    def receive(self, payload: str):
+        message = json.loads(payload)
+        if message["origin"] == self.origin:
+            return
+        self._received += 1
+        self._dispatch(message["kind"], message["key"])
+
+    def receive_reset(self):
+        self._dispatch(RESET, None)
+
+    def _dispatch(self, kind: str, key: Any):
+        for handler in self._handlers[kind]:
+            handler(key)
+
+    def stats(self) -> dict:
+        stats = {"published": self._published, "received": self._received}
+        if self._backend is not None:
+            stats.update(self._backend.stats())
+        return stats
+
+
+invalidation_bus = InvalidationBus()
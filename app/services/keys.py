@@ -0,0 +1,143 @@
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, NamedTuple
+
+import jwt
+from jwt.algorithms import get_default_algorithms
+from jwt.exceptions import InvalidTokenError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenKey(NamedTuple):
+    kid: str | None
+    algorithm: str
+    # Parsed key objects, None for sign_key on verification-only keys
+    sign_key: Any
+    verify_key: Any
+
+
+class KeyRing:
+    """Keys that sign and verify access tokens.
+
+    Without a keys file tokens are signed with the shared secret_key and
+    carry no kid. With one, tokens are signed with the key named by
+    signing_kid and verified with whichever key their kid header names, so
+    old and new keys are accepted side by side during a rotation. Tokens
+    without a kid are still verified with secret_key while it is configured.
+
+    Keys are parsed once when the file is read. The file is checked for
+    changes at most every reload_seconds, so rotating keys needs no restart.
+    Subscribers are called whenever the keys are replaced, so that caches of
+    verified tokens drop tokens of a key that may be gone.
+    """
+
+    def __init__(self):
+        self._secret_key: TokenKey | None = None
+        self._keys: dict[str | None, TokenKey] = {}
+        self._signing_kid: str | None = None
+        self._file: str | None = None
+        self._reload_seconds = 60.0
+        self._mtime: float | None = None
+        self._next_check = 0.0
+        self._subscribers: list[Callable[[], None]] = []
+
+    def subscribe(self, callback: Callable[[], None]):
+        self._subscribers.append(callback)
+
+    def _changed(self):
+        for callback in self._subscribers:
+            callback()
+
+    def configure(self, secret_key: str | None = None, algorithm: str = "HS256",
+                  file: str | None = None, reload_seconds: float = 60):
+        self._secret_key = TokenKey(None, algorithm, secret_key, secret_key) if secret_key else None
+        self._file = file
+        self._reload_seconds = reload_seconds
+        self._mtime = None
+        self._next_check = 0.0
+        if file is None:
+            if self._secret_key is None:
+                raise ValueError("Either secret_key or a token keys file is needed")
+            self._keys = {None: self._secret_key}
+            self._signing_kid = None
+        else:
+            self._mtime = os.stat(file).st_mtime
+            self._load()
+            self._next_check = time.monotonic() + reload_seconds
+        self._changed()
+
+    @property
+    def reload_seconds(self) -> float:
+        return self._reload_seconds
+
+    def _load(self):
+        with open(self._file) as f:
+            keyset = json.load(f)
+        directory = os.path.dirname(os.path.abspath(self._file))
+        algorithms = get_default_algorithms()
+        keys = {None: self._secret_key} if self._secret_key else {}
+        for entry in keyset["keys"]:
+            algorithm = algorithms[entry["algorithm"]]
+            if "private_key_file" in entry:
+                with open(os.path.join(directory, entry["private_key_file"]), "rb") as f:
+                    sign_key = algorithm.prepare_key(f.read())
+                verify_key = sign_key.public_key()
+            else:
+                with open(os.path.join(directory, entry["public_key_file"]), "rb") as f:
+                    sign_key, verify_key = None, algorithm.prepare_key(f.read())
+            keys[entry["kid"]] = TokenKey(entry["kid"], entry["algorithm"], sign_key, verify_key)
+        signing_kid = keyset["signing_kid"]
+        if keys.get(signing_kid) is None or keys[signing_kid].sign_key is None:
+            raise ValueError(f"No private key for signing key '{signing_kid}'")
+        self._keys = keys
+        self._signing_kid = signing_kid
+
+    def refresh(self):
+        """Reload the keys file if reload_seconds have passed and it changed.
+        Called by sign(), decode() and jwks(), and by callers that use
+        cached tokens without decoding them."""
+        if self._file is None or time.monotonic() < self._next_check:
+            return
+        self._next_check = time.monotonic() + self._reload_seconds
+        try:
+            mtime = os.stat(self._file).st_mtime
+            if mtime != self._mtime:
+                self._load()
+                self._mtime = mtime
+                self._changed()
+        except Exception:
+            # Keep the keys in use, the file may be half way through an edit
+            logger.exception("Could not reload token keys from %s", self._file)
+
+    def sign(self, claims: dict) -> str:
+        self.refresh()
+        key = self._keys[self._signing_kid]
+        headers = {"kid": key.kid} if key.kid is not None else None
+        return jwt.encode(claims, key.sign_key, algorithm=key.algorithm, headers=headers)
+
+    def decode(self, token: str) -> dict:
+        self.refresh()
+        key = self._keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise InvalidTokenError("Unknown signing key")
+        # Only the key's own algorithm, a token cannot pick another one
+        return jwt.decode(token, key.verify_key, algorithms=[key.algorithm])
+
+    def jwks(self) -> dict:
+        """Public keys as a JSON Web Key Set. The shared secret is never listed."""
+        self.refresh()
+        algorithms = get_default_algorithms()
+        keys = []
+        for key in self._keys.values():
+            if key.kid is None:
+                continue
+            jwk = algorithms[key.algorithm].to_jwk(key.verify_key, as_dict=True)
+            jwk.update({"kid": key.kid, "alg": key.algorithm, "use": "sig"})
+            keys.append(jwk)
+        return {"keys": keys}
+
+
+keyring = KeyRing()
@@ -0,0 +1,191 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class RequestTimings:
+    """Time spent by one request, filled in by the engine events and the
+    password hasher while the request runs."""
+    __slots__ = ("scope", "sql_count", "sql_seconds", "hash_seconds")
+
+    def __init__(self, scope: dict | None = None):
+        self.scope = scope
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.hash_seconds = 0.0
+
+
+# The timings of the request being handled, None outside of a request
+request_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = request_timings.get()
+    start = conn.info.pop("query_start", None)
+    if timings is not None and start is not None:
+        timings.sql_count += 1
+        timings.sql_seconds += time.perf_counter() - start
+
+
+def instrument_engine(engine: AsyncEngine):
+    """Count the statements and time of an engine against the current request."""
+    if not event.contains(engine.sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def current_route() -> str | None:
+    """Method and route template (or path, before routing) of the request
+    being handled, None outside of a request."""
+    timings = request_timings.get()
+    if timings is None or timings.scope is None:
+        return None
+    scope = timings.scope
+    return f'{scope["method"]} {getattr(scope.get("route"), "path", scope["path"])}'
+
+
+def observe_password_hashing(seconds: float):
+    timings = request_timings.get()
+    if timings is not None:
+        timings.hash_seconds += seconds
+
+
+def _labels(**labels) -> str:
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+class RouteMetrics:
+    __slots__ = ("buckets", "count", "seconds", "sql_count", "sql_seconds", "hash_seconds")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.count = 0
+        self.seconds = 0.0
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.hash_seconds = 0.0
+
+
+class MetricsRegistry:
+    """Request metrics per method, route template and status, rendered in
+    the Prometheus text format.
+
+    Routes are labelled with their template (/api/users/{id}), requests that
+    match no route with "unmatched", so the number of series stays bounded.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, buckets: list[float] = DEFAULT_BUCKETS, server_timing: bool = True):
+        self._bounds = sorted(buckets)
+        self.server_timing = server_timing
+        self.reset()
+
+    def reset(self):
+        self._routes: dict[tuple[str, str, int], RouteMetrics] = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: float, timings: RequestTimings):
+        key = (method, route, status)
+        metrics = self._routes.get(key)
+        if metrics is None:
+            metrics = self._routes[key] = RouteMetrics(len(self._bounds))
+        # Buckets are stored non cumulative and summed up on render
+        index = bisect_left(self._bounds, seconds)
+        if index < len(self._bounds):
+            metrics.buckets[index] += 1
+        metrics.count += 1
+        metrics.seconds += seconds
+        metrics.sql_count += timings.sql_count
+        metrics.sql_seconds += timings.sql_seconds
+        metrics.hash_seconds += timings.hash_seconds
+
+    def render(self) -> str:
+        lines = [
+            "# HELP http_request_duration_seconds Wall time of HTTP requests.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route, status), metrics in sorted(self._routes.items()):
+            labels = _labels(method=method, route=route, status=status)
+            cumulative = 0
+            for bound, count in zip(self._bounds, metrics.buckets):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {metrics.count}')
+            lines.append(f"http_request_duration_seconds_sum{{{labels}}} {metrics.seconds}")
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {metrics.count}")
+
+        for name, attribute, help in (
+                ("http_request_sql_statements_total", "sql_count", "SQL statements executed by HTTP requests."),
+                ("http_request_sql_seconds_total", "sql_seconds", "Time HTTP requests spent in SQL statements."),
+                ("http_request_password_hashing_seconds_total", "hash_seconds",
+                 "Time HTTP requests spent waiting for password hashing.")):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} counter")
+            for (method, route, status), metrics in sorted(self._routes.items()):
+                labels = _labels(method=method, route=route, status=status)
+                lines.append(f"{name}{{{labels}}} {getattr(metrics, attribute)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+def server_timing(seconds: float, timings: RequestTimings) -> str:
+    return (f'app;dur={seconds * 1000:.1f}, '
+            f'db;dur={timings.sql_seconds * 1000:.1f};desc="{timings.sql_count} queries", '
+            f'hash;dur={timings.hash_seconds * 1000:.1f}')
+
+
+class InstrumentationMiddleware:
+    """ASGI middleware that times each HTTP request, records it in the
+    registry and, when enabled, adds a Server-Timing header.
+
+    The header is written when the response starts, so it covers the
+    handler, its SQL and the serialization of the body, but not the sending
+    of a streamed body.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = metrics_registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(scope)
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.registry.server_timing:
+                    header = server_timing(time.perf_counter() - start, timings)
+                    message["headers"] = [*message.get("headers", []),
+                                          (b"server-timing", header.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
+            # The router puts the matched route in the scope
+            route = scope.get("route")
+            self.registry.observe(scope["method"], getattr(route, "path", "unmatched"), status,
+                                  time.perf_counter() - start, timings)
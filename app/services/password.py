@@ -0,0 +1,99 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from passlib.context import CryptContext
+
+from app.services.metrics import observe_password_hashing
+
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+# Module level functions so that they can be pickled for a process pool
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class PasswordHasherBusy(RuntimeError):
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop on a bounded thread or process pool.
+
+    At most max_queue calls may be in flight (running or waiting for a
+    worker). Calls beyond that raise PasswordHasherBusy instead of queueing,
+    so a login burst cannot pile up unbounded work behind the pool.
+    """
+
+    def __init__(self):
+        self._executor: Executor | None = None
+        self._max_queue = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def init(self, executor: str = "thread", max_workers: int | None = None, max_queue: int = 64):
+        self.close()
+        if executor == "thread":
+            self._executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="password-hasher")
+        elif executor == "process":
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f"Unknown password hashing executor '{executor}'")
+        self._max_queue = max_queue
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            raise RuntimeError("PasswordHasher is not initialized")
+        if self._in_flight >= self._max_queue:
+            self._rejected += 1
+            raise PasswordHasherBusy("Too many password operations in progress")
+
+        self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._in_flight -= 1
+            self._completed += 1
+            # Includes the wait for a free worker, which is what the request sees
+            observe_password_hashing(time.perf_counter() - start)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(_verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """Verify with a single bcrypt run and return a new hash when the stored
+        one uses deprecated settings (CryptContext.needs_update), else None."""
+        return await self._run(_verify_and_update, password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "max_queue": self._max_queue,
+            "completed": self._completed,
+            "rejected": self._rejected,
+        }
+
+
+password_hasher = PasswordHasher()
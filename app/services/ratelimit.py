@@ -0,0 +1,133 @@
+import ipaddress
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from app.services.database import sessionmanager
+from app.sqlalchemy_models.login import LoginBucket
+
+
+class MemoryBuckets:
+    """Token buckets of this worker. At most max_keys buckets are kept, the
+    least recently used ones are forgotten (that is, refilled) first."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self._max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, capacity: float, refill_per_second: float, now: float) -> float:
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        if tokens < 1:
+            return (1 - tokens) / refill_per_second
+        self._buckets[key] = (tokens - 1, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self._max_keys:
+            self._buckets.popitem(last=False)
+        return 0.0
+
+    async def prune(self, full_before: float):
+        self._buckets = OrderedDict((key, bucket) for key, bucket in self._buckets.items()
+                                    if bucket[1] >= full_before)
+
+
+class DatabaseBuckets:
+    """Token buckets in the login_buckets table, shared by all workers."""
+
+    def __init__(self, session: Callable | None = None):
+        self._session = session or sessionmanager.session
+
+    async def take(self, key: str, capacity: float, refill_per_second: float, now: float) -> float:
+        async with self._session() as session:
+            return await LoginBucket.take(session, key, capacity, refill_per_second, now)
+
+    async def prune(self, full_before: float):
+        async with self._session() as session:
+            await LoginBucket.prune(session, full_before)
+
+
+class LoginLimiter:
+    """Token bucket limits on login attempts per client IP and per username.
+
+    Checked before the user lookup and the bcrypt verify, so a credential
+    stuffing run is turned away at the cost of a dictionary lookup (memory
+    backend) or one upsert (database backend). The IP bucket is taken first
+    and an attempt rejected on IP does not drain the username's bucket.
+
+    Behind a reverse proxy every request comes from the proxy's address.
+    With the proxy listed in trusted_proxies the client IP is read from
+    X-Forwarded-For instead. ip_capacity None turns the IP bucket off.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self.configure()
+
+    def configure(self, backend: str = "memory", ip_capacity: float | None = 50, ip_refill_per_second: float = 1,
+                  username_capacity: float = 20, username_refill_per_second: float = 0.2,
+                  trusted_proxies: list[str] = (), prune_seconds: float = 60,
+                  session: Callable | None = None, **options):
+        if backend == "memory":
+            self._buckets = MemoryBuckets(**options)
+        elif backend == "database":
+            self._buckets = DatabaseBuckets(session, **options)
+        else:
+            raise ValueError(f"Unknown login rate limit backend '{backend}'")
+        self._limits = {"username": (username_capacity, username_refill_per_second)}
+        if ip_capacity is not None:
+            self._limits["ip"] = (ip_capacity, ip_refill_per_second)
+        # Addresses or networks such as "10.0.0.0/8"
+        self._trusted_proxies = [ipaddress.ip_network(proxy) for proxy in trusted_proxies]
+        # A bucket untouched for this long is full again
+        self._refill_seconds = max(capacity / refill for capacity, refill in self._limits.values())
+        self._prune_seconds = prune_seconds
+        self._next_prune = 0.0
+        self._allowed = 0
+        self._rejected = {"ip": 0, "username": 0}
+
+    async def check(self, ip: str | None, username: str) -> float:
+        """Count a login attempt. Returns 0 when it may go ahead, otherwise
+        the seconds after which the client may try again."""
+        now = self._clock()
+        if now >= self._next_prune:
+            self._next_prune = now + self._prune_seconds
+            await self._buckets.prune(now - self._refill_seconds)
+        for kind, value in (("ip", ip), ("username", username.lower())):
+            if value is None or kind not in self._limits:
+                continue
+            capacity, refill_per_second = self._limits[kind]
+            wait = await self._buckets.take(f"{kind}:{value}", capacity, refill_per_second, now)
+            if wait > 0:
+                self._rejected[kind] += 1
+                return wait
+        self._allowed += 1
+        return 0.0
+
+    def _trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address.strip())
+        except ValueError:
+            return False
+        return any(ip in network for network in self._trusted_proxies)
+
+    def client_ip(self, peer: str | None, forwarded_for: str | None = None) -> str | None:
+        """The IP to limit: the peer, or when the peer is a trusted proxy,
+        the last address in X-Forwarded-For that is not a trusted proxy.
+        Addresses further left were written by the client and can be forged."""
+        if peer is None or not forwarded_for or not self._trusted(peer):
+            return peer
+        addresses = [address.strip() for address in forwarded_for.split(",") if address.strip()]
+        for address in reversed(addresses):
+            if not self._trusted(address):
+                return address
+        return addresses[0] if addresses else peer
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self._allowed,
+            "rejected_ip": self._rejected["ip"],
+            "rejected_username": self._rejected["username"],
+        }
+
+
+login_limiter = LoginLimiter()
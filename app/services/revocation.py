@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+
+from app.services.database import sessionmanager
+from app.services.invalidation import invalidation_bus, TOKEN, USER_TOKENS, RESET
+from app.sqlalchemy_models.token import RevokedToken
+
+logger = logging.getLogger(__name__)
+
+
+class RevocationList:
+    """In-memory copy of the unexpired rows of revoked_tokens.
+
+    Checks are dict lookups, so the request path never queries the table.
+    Entries are dropped once the tokens they cover have expired, checked at
+    most every prune_seconds.
+    """
+
+    def __init__(self, prune_seconds: float = 60):
+        self._prune_seconds = prune_seconds
+        self._tokens: dict[str, float] = {}
+        self._users: dict[int, tuple[float, float]] = {}
+        self._next_prune = 0.0
+
+    def revoke_token(self, jti: str, expires_at: float):
+        self._tokens[jti] = expires_at
+
+    def revoke_user(self, user_id: int, issued_before: float, expires_at: float):
+        current = self._users.get(user_id)
+        if current is None or current[0] < issued_before:
+            self._users[user_id] = (issued_before, expires_at)
+
+    def is_revoked(self, claims: dict, user_id: int | None = None) -> bool:
+        """Whether the token with these claims was revoked by jti, or issued
+        to user_id before the user's tokens were revoked. Tokens without an
+        iat claim count as issued before any revocation."""
+        now = time.time()
+        if now >= self._next_prune:
+            self.prune(now)
+        if self._tokens.get(claims.get("jti"), 0) > now:
+            return True
+        cutoff = self._users.get(user_id)
+        return cutoff is not None and cutoff[1] > now and claims.get("iat", 0) < cutoff[0]
+
+    def prune(self, now: float | None = None):
+        now = time.time() if now is None else now
+        self._tokens = {jti: expires_at for jti, expires_at in self._tokens.items() if expires_at > now}
+        self._users = {user_id: cutoff for user_id, cutoff in self._users.items() if cutoff[1] > now}
+        self._next_prune = now + self._prune_seconds
+
+    def load(self, revocations: list[RevokedToken]):
+        self.clear()
+        for revocation in revocations:
+            if revocation.jti is not None:
+                self.revoke_token(revocation.jti, revocation.expires_at.timestamp())
+            else:
+                self.revoke_user(revocation.user_id, revocation.issued_before.timestamp(),
+                                 revocation.expires_at.timestamp())
+
+    def clear(self):
+        self._tokens.clear()
+        self._users.clear()
+
+    def stats(self) -> dict:
+        return {"tokens": len(self._tokens), "users": len(self._users)}
+
+
+revocation_list = RevocationList()
+
+
+async def load_revocations():
+    async with sessionmanager.session() as session:
+        revocation_list.load(await RevokedToken.active(session))
+
+
+# The loop keeps only weak references to tasks, these keep the reloads alive
+_reload_tasks: set[asyncio.Task] = set()
+
+
+def _reload_done(task: asyncio.Task):
+    _reload_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Could not reload the revoked tokens", exc_info=task.exception())
+
+
+def reload_revocations(_=None):
+    # Messages may have been missed, read the table again
+    task = asyncio.get_running_loop().create_task(load_revocations())
+    _reload_tasks.add(task)
+    task.add_done_callback(_reload_done)
+
+
+invalidation_bus.subscribe(TOKEN, lambda key: revocation_list.revoke_token(*key))
+invalidation_bus.subscribe(USER_TOKENS, lambda key: revocation_list.revoke_user(*key))
+invalidation_bus.subscribe(RESET, reload_revocations)
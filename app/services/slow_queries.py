@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+from weakref import WeakKeyDictionary
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.services.metrics import current_route
+
+
+logger = logging.getLogger(__name__)
+
+# Plans are taken on a separate connection, so ANALYZE runs the query again.
+# Only SELECTs are explained, PostgreSQL with ANALYZE, SQLite without.
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+
+def redact(parameters, executemany: bool = False):
+    """Parameter types instead of values, so that passwords, emails and
+    token hashes stay out of the log."""
+    if executemany:
+        return f"<{len(parameters)} parameter sets>"
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class SlowQueryLog:
+    """Logs statements that take threshold_seconds or longer.
+
+    At most max_per_minute statements are logged, the number left out is
+    logged by a timer when the minute ends. With explain set, a slow SELECT is
+    explained in the background at most once per explain_interval_seconds.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._engines: WeakKeyDictionary = WeakKeyDictionary()
+        self._tasks: set[asyncio.Task] = set()
+        self._report: asyncio.TimerHandle | None = None
+        self.configure()
+
+    def configure(self, threshold_seconds: float | None = 0.5, max_per_minute: int = 60,
+                  explain: bool = False, explain_interval_seconds: float = 60):
+        self.threshold_seconds = threshold_seconds
+        self._max_per_minute = max_per_minute
+        self._explain = explain
+        self._explain_interval_seconds = explain_interval_seconds
+        self._next_explain = 0.0
+        self._cancel_report()
+        self._window_start = self._clock()
+        self._window_logged = 0
+        self._logged = 0
+        self._suppressed = 0
+        self._explained = 0
+
+    def watch(self, engine: AsyncEngine):
+        # The sync engine of the events leads back to the engine to explain on
+        if engine.sync_engine not in self._engines:
+            self._engines[engine.sync_engine] = engine
+            event.listen(engine.sync_engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(engine.sync_engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["slow_query_start"] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("slow_query_start", None)
+        if start is None or self.threshold_seconds is None:
+            return
+        seconds = time.perf_counter() - start
+        # The plans themselves are not logged again
+        if seconds >= self.threshold_seconds and not statement.startswith("EXPLAIN"):
+            self.record(conn, statement, parameters, executemany, seconds)
+
+    def _allow(self) -> bool:
+        now = self._clock()
+        if now - self._window_start >= 60:
+            self._end_window(now)
+        self._window_logged += 1
+        if self._window_logged > self._max_per_minute:
+            self._suppressed += 1
+            if self._window_logged == self._max_per_minute + 1:
+                self._schedule_report(self._window_start + 60 - now)
+            return False
+        return True
+
+    def _end_window(self, now: float):
+        self._cancel_report()
+        suppressed = self._window_logged - self._max_per_minute
+        if suppressed > 0:
+            logger.warning("%d slow queries were not logged in the last minute", suppressed)
+        self._window_start = now
+        self._window_logged = 0
+
+    def _schedule_report(self, delay: float):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Without a loop the count is logged with the next slow query
+            return
+        self._report = loop.call_later(max(delay, 0), lambda: self._end_window(self._clock()))
+
+    def _cancel_report(self):
+        if self._report is not None:
+            self._report.cancel()
+            self._report = None
+
+    def record(self, conn, statement: str, parameters, executemany: bool, seconds: float):
+        if not self._allow():
+            return
+        self._logged += 1
+        route = current_route()
+        logger.warning("Slow query %.1f ms (%s): %s parameters %s", seconds * 1000,
+                       route or "outside a request", statement, redact(parameters, executemany))
+
+        prefix = EXPLAIN_PREFIXES.get(conn.dialect.name)
+        now = self._clock()
+        if (not self._explain or prefix is None or executemany or now < self._next_explain
+                or statement.lstrip()[:6].upper() != "SELECT"):
+            return
+        engine = self._engines.get(conn.engine)
+        if engine is None:
+            return
+        self._next_explain = now + self._explain_interval_seconds
+        task = asyncio.get_running_loop().create_task(
+            self._log_plan(engine, prefix + statement, parameters, route))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _log_plan(self, engine: AsyncEngine, statement: str, parameters, route: str | None):
+        try:
+            async with engine.connect() as connection:
+                result = await connection.exec_driver_sql(statement, parameters)
+                plan = "\n".join(str(row[-1]) for row in result)
+        except Exception:
+            logger.exception("Could not explain slow query")
+            return
+        self._explained += 1
+        logger.warning("Plan of slow query (%s): %s\n%s", route or "outside a request", statement, plan)
+
+    async def close(self):
+        self._cancel_report()
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "threshold_seconds": self.threshold_seconds,
+            "logged": self._logged,
+            "suppressed": self._suppressed,
+            "explained": self._explained,
+        }
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,251 @@
+import contextlib
+import functools
+import time
+from collections import deque
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import ORMExecuteState, Session
+
+
+class Span:
+    """A finished or running span of the memory exporter. Has the subset of
+    the OpenTelemetry span interface that the app uses."""
+    __slots__ = ("name", "attributes", "parent", "start", "end_time", "exception", "_exporter")
+
+    def __init__(self, name: str, attributes: dict, parent: "Span | None", exporter: "MemoryExporter"):
+        self.name = name
+        self.attributes = dict(attributes)
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end_time: float | None = None
+        self.exception: BaseException | None = None
+        self._exporter = exporter
+
+    @property
+    def duration(self) -> float | None:
+        return None if self.end_time is None else self.end_time - self.start
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def update_name(self, name: str):
+        self.name = name
+
+    def record_exception(self, exception: BaseException):
+        self.exception = exception
+
+    def end(self):
+        if self.end_time is None:
+            self.end_time = time.perf_counter()
+            self._exporter.export(self)
+
+    def __repr__(self):
+        return f"<Span {self.name} {self.attributes}>"
+
+
+class NoopSpan:
+    __slots__ = ()
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def update_name(self, name: str):
+        pass
+
+    def record_exception(self, exception: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class MemoryExporter:
+    """Keeps the last max_spans finished spans in process, for tests and for
+    looking at a single worker without a collector."""
+
+    def __init__(self, max_spans: int = 10_000):
+        self._spans: deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self._spans.append(span)
+
+    @property
+    def spans(self) -> list[Span]:
+        return list(self._spans)
+
+    def clear(self):
+        self._spans.clear()
+
+
+# The innermost open span of the memory exporter
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Creates spans for the configured exporter.
+
+    "none" (the default) hands out a shared no-op span. "memory" records the
+    spans in a MemoryExporter. "opentelemetry" creates OpenTelemetry spans
+    (pip install opentelemetry-api) on the globally configured tracer
+    provider, so the OpenTelemetry SDK decides where they are sent.
+    """
+
+    def __init__(self):
+        self.configure()
+
+    def configure(self, exporter: str = "none", max_spans: int = 10_000,
+                  service_name: str = "fastapi_with_auth"):
+        self.exporter: MemoryExporter | None = None
+        self._otel = None
+        if exporter == "memory":
+            self.exporter = MemoryExporter(max_spans)
+        elif exporter == "opentelemetry":
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise RuntimeError("The opentelemetry tracing exporter needs the opentelemetry-api package")
+            self._otel = trace.get_tracer(service_name)
+        elif exporter != "none":
+            raise ValueError(f"Unknown tracing exporter '{exporter}'")
+        self.enabled = exporter != "none"
+
+    def start_span(self, name: str, **attributes):
+        """Start a span under the current one without making it current.
+        The caller ends it."""
+        if self._otel is not None:
+            return self._otel.start_span(name, attributes=attributes)
+        if self.exporter is not None:
+            return Span(name, attributes, _current_span.get(), self.exporter)
+        return NOOP_SPAN
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes):
+        """Span around a block, current while the block runs."""
+        if self._otel is not None:
+            with self._otel.start_as_current_span(name, attributes=attributes) as span:
+                yield span
+            return
+        if self.exporter is None:
+            yield NOOP_SPAN
+            return
+
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as exception:
+            span.record_exception(exception)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+
+tracer = Tracer()
+
+
+def _row_count(result) -> int | None:
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple, set, frozenset)):
+        return len(result)
+    if hasattr(result, "__table__"):
+        return 1
+    return None
+
+
+def traced(method):
+    """Span named after the qualified name of an async model method, with
+    the number of entities it returns as the rows attribute."""
+    name = method.__qualname__
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        if not tracer.enabled:
+            return await method(*args, **kwargs)
+        with tracer.span(name) as span:
+            result = await method(*args, **kwargs)
+            rows = _row_count(result)
+            if rows is not None:
+                span.set_attribute("rows", rows)
+            return result
+
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if tracer.enabled:
+        conn.info["trace_span"] = tracer.start_span(
+            f"SQL {statement.split(None, 1)[0].upper()}",
+            **{"db.system": conn.dialect.name, "db.statement": statement})
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = conn.info.pop("trace_span", None)
+    if span is not None:
+        # -1 for SELECTs on drivers that only know the count after fetching
+        if cursor.rowcount >= 0:
+            span.set_attribute("rows", cursor.rowcount)
+        span.end()
+
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    span = connection.info.pop("trace_span", None) if connection is not None else None
+    if span is not None:
+        span.record_exception(exception_context.original_exception)
+        span.end()
+
+
+def trace_engine(engine: AsyncEngine):
+    """Give every SQL statement of an engine a span under the current one."""
+    if not event.contains(engine.sync_engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _trace_relationship_load(state: ORMExecuteState):
+    # selectinload batches and lazy loads get a span with the relationship
+    # and the number of rows loaded. The result is buffered to count it.
+    if not tracer.enabled or not state.is_relationship_load:
+        return None
+    relationship = str(state.loader_strategy_path[-1])
+    with tracer.span(f"load {relationship}", relationship=relationship) as span:
+        result = state.invoke_statement().freeze()
+        span.set_attribute("rows", len(result.data))
+    return result()
+
+
+class TracingMiddleware:
+    """ASGI middleware that opens a span per HTTP request, named after the
+    method and the route template once the router has matched it."""
+
+    def __init__(self, app, tracer: Tracer = tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        with self.tracer.span(method, **{"http.method": method, "http.target": scope["path"]}) as span:
+            async def send_with_status(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route is not None:
+                    span.update_name(f"{method} {route}")
+                    span.set_attribute("http.route", route)
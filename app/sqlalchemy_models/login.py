@@ -0,0 +1,52 @@
+# Standard libary imports
+from sqlalchemy import String, Float, case, select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+
+
+# App imports
+from app.services.database import Base, dialect_insert
+
+
+class LoginBucket(Base):
+    """Token bucket of login attempts for one key (an IP or a username),
+    shared by all workers. A missing row is a full bucket."""
+    __tablename__ = "login_buckets"
+    key: Mapped[str] = mapped_column(String, primary_key=True)
+    tokens: Mapped[float] = mapped_column(Float, nullable=False)
+    # Seconds since the epoch, so that workers on different hosts agree
+    updated_at: Mapped[float] = mapped_column(Float, nullable=False, index=True)
+
+    @classmethod
+    async def take(cls, db: AsyncSession, key: str, capacity: float, refill_per_second: float, now: float) -> float:
+        """Take one token with a single upsert. Returns 0 when it was taken,
+        otherwise the seconds until the bucket holds a token again."""
+        available = cls.tokens + (now - cls.updated_at) * refill_per_second
+        refilled = case((available > capacity, capacity), else_=available)
+        statement = (dialect_insert(db, cls)
+                     .values(key=key, tokens=capacity - 1, updated_at=now)
+                     .on_conflict_do_update(index_elements=[cls.key],
+                                            set_={"tokens": refilled - 1, "updated_at": now},
+                                            where=refilled >= 1)
+                     .returning(cls.tokens))
+        try:
+            taken = (await db.execute(statement)).first() is not None
+            wait = 0.0
+            if not taken:
+                tokens = (await db.execute(select(refilled).where(cls.key == key))).scalar_one()
+                wait = (1 - tokens) / refill_per_second
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        return wait
+
+    @classmethod
+    async def prune(cls, db: AsyncSession, full_before: float) -> None:
+        # Rows last touched before full_before have refilled, dropping them changes nothing
+        try:
+            await db.execute(delete(cls).where(cls.updated_at < full_before))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
@@ -0,0 +1,149 @@
+# Standard libary imports
+import hashlib
+import secrets
+from datetime import datetime, timedelta, UTC
+from sqlalchemy import String, Integer, LargeBinary, Uuid, ForeignKey, select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy_utc import UtcDateTime
+from typing import Optional
+from uuid import UUID, uuid4
+
+
+# App imports
+from app.config import get_config
+from app.services.database import SubBaseEntity
+from app.services.invalidation import invalidation_bus, TOKEN, USER_TOKENS
+
+
+class RevokedToken(SubBaseEntity):
+    """A revoked access token (jti) or a cutoff for all tokens of a user
+    issued before issued_before. Rows are kept until every token they cover
+    has expired."""
+    __tablename__ = "revoked_tokens"
+    jti: Mapped[Optional[str]] = mapped_column(String, unique=True)
+    user_id: Mapped[Optional[int]] = mapped_column(Integer)
+    issued_before: Mapped[Optional[datetime]] = mapped_column(UtcDateTime(timezone=True))
+    expires_at: Mapped[datetime] = mapped_column(UtcDateTime(timezone=True), nullable=False, index=True)
+
+    @classmethod
+    async def active(cls, db: AsyncSession) -> list["RevokedToken"]:
+        query = select(cls).where(cls.expires_at > datetime.now(UTC))
+        return (await db.execute(query)).scalars().all()
+
+    @classmethod
+    async def prune(cls, db: AsyncSession) -> None:
+        # Uses the expires_at index, runs in the caller's transaction
+        await db.execute(delete(cls).where(cls.expires_at <= datetime.now(UTC)))
+
+    @classmethod
+    async def revoke_token(cls, db: AsyncSession, jti: str, expires_at: datetime) -> "RevokedToken":
+        revocation = cls(jti=jti, expires_at=expires_at)
+        try:
+            await cls.prune(db)
+            db.add(revocation)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        revocation.publish()
+        return revocation
+
+    @classmethod
+    async def stage_user_revocation(cls, db: AsyncSession, user_id: int) -> "RevokedToken":
+        """Add a revocation of every token issued to the user so far to the
+        session. The caller commits it together with the change that causes it
+        and then calls publish()."""
+        now = datetime.now(UTC)
+        lifetime = timedelta(minutes=get_config()['access_token_expire_minutes'])
+        await cls.prune(db)
+        revocation = cls(user_id=user_id, issued_before=now, expires_at=now + lifetime)
+        db.add(revocation)
+        return revocation
+
+    def publish(self) -> None:
+        # Tell the revocation lists of all workers, after commit
+        if self.jti is not None:
+            invalidation_bus.publish(TOKEN, [self.jti, self.expires_at.timestamp()])
+        else:
+            invalidation_bus.publish(USER_TOKENS, [self.user_id, self.issued_before.timestamp(),
+                                                   self.expires_at.timestamp()])
+
+
+class RefreshToken(SubBaseEntity):
+    """One refresh token of a family. Tokens are rotated on every use.
+
+    Only the SHA-256 digest of a token is stored. A rotated token keeps its
+    row with used_at set, so that presenting it again is recognised as reuse
+    of a stolen token and ends the whole family. Every token of a family
+    expires with the first one, so using a family does not extend it.
+    """
+    __tablename__ = "refresh_tokens"
+    token_hash: Mapped[bytes] = mapped_column(LargeBinary(32), nullable=False, unique=True)
+    family: Mapped[UUID] = mapped_column(Uuid, nullable=False, index=True)
+    # Deleting a user deletes their tokens, SQLite may hand the id out again
+    user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"),
+                                         nullable=False, index=True)
+    expires_at: Mapped[datetime] = mapped_column(UtcDateTime(timezone=True), nullable=False, index=True)
+    used_at: Mapped[Optional[datetime]] = mapped_column(UtcDateTime(timezone=True))
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    @classmethod
+    def _new(cls, db: AsyncSession, user_id: int, family: UUID, expires_at: datetime) -> str:
+        token = secrets.token_urlsafe(32)
+        db.add(cls(token_hash=cls.digest(token), family=family, user_id=user_id, expires_at=expires_at))
+        return token
+
+    @classmethod
+    async def issue(cls, db: AsyncSession, user_id: int, expires_at: datetime) -> str:
+        """Start a new family for a password login and return its first token."""
+        try:
+            await db.execute(delete(cls).where(cls.expires_at <= datetime.now(UTC)))
+            token = cls._new(db, user_id, uuid4(), expires_at)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        return token
+
+    @classmethod
+    async def owner(cls, db: AsyncSession, token: str) -> int:
+        """The id of the user a refresh token was issued to, used or not."""
+        user_id = await db.scalar(select(cls.user_id).where(cls.token_hash == cls.digest(token)))
+        if user_id is None:
+            raise ValueError("Invalid refresh token")
+        return user_id
+
+    @classmethod
+    async def rotate(cls, db: AsyncSession, token: str) -> tuple[int, str]:
+        """Use a refresh token up and return (user_id, next token of its family)."""
+        now = datetime.now(UTC)
+        token_hash = cls.digest(token)
+        try:
+            # Marking the token used is the lookup, a concurrent second use finds it used
+            statement = (update(cls)
+                         .where(cls.token_hash == token_hash, cls.used_at.is_(None), cls.expires_at > now)
+                         .values(used_at=now)
+                         .returning(cls.user_id, cls.family, cls.expires_at))
+            row = (await db.execute(statement)).first()
+            if row is None:
+                reused = await db.scalar(select(cls.family).where(
+                    cls.token_hash == token_hash, cls.used_at.is_not(None)))
+                if reused is not None:
+                    await db.execute(delete(cls).where(cls.family == reused))
+                    await db.commit()
+                raise ValueError("Invalid refresh token")
+            next_token = cls._new(db, row.user_id, row.family, row.expires_at)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        return row.user_id, next_token
+
+    @classmethod
+    async def stage_user_revocation(cls, db: AsyncSession, user_id: int) -> None:
+        # Committed by the caller, together with the change that causes it
+        await db.execute(delete(cls).where(cls.user_id == user_id))
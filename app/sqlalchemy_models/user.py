@@ -1,16 +1,20 @@
 # Standard libary imports
-from sqlalchemy import Column, String, Boolean, select, Table, ForeignKey, Integer, UniqueConstraint
+import functools
+from sqlalchemy import Column, String, Boolean, or_, select, insert, update, delete, bindparam, Table, ForeignKey, Integer, UniqueConstraint, Index
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, mapped_column, relationship, selectinload
 from sqlalchemy.sql import func
-from uuid import uuid4
-from typing import Optional, List
+from uuid import UUID
+from typing import AsyncIterator, Optional, List
 from sqlalchemy_utc import UtcDateTime, utcnow
 
 
 # App imports
-from app.services.database import BaseEntity
+from app.services.invalidation import invalidation_bus, USER, ROLES
+from app.sqlalchemy_models.token import RevokedToken, RefreshToken
+from app.services.database import BaseEntity, dialect_insert
+from app.services.tracing import traced
 
 
 association_table = Table(
@@ -22,122 +26,318 @@ association_table = Table(
            server_default=utcnow()),
     Column("udpated_at", UtcDateTime(timezone=True), nullable=False,
            server_default=utcnow(), onupdate=utcnow()),
-    UniqueConstraint("user_id", "role_id")
+    UniqueConstraint("user_id", "role_id"),
+    # The unique constraint covers lookups by user_id, Role.users needs role_id
+    Index("ix_user_role_association_role_id", "role_id"),
 )
 
 
+def invalidate_user(user_id: int) -> None:
+    # Called after a successful commit that changes what a user may do. The
+    # bus drops the user from this worker's caches and tells the other workers.
+    invalidation_bus.publish(USER, user_id)
+
+
+def invalidate_roles() -> None:
+    # A renamed or deleted role changes the role names of all its users
+    invalidation_bus.publish(ROLES)
+
+
+async def write_returning(db: AsyncSession, statement, integrity_error: str | None = None):
+    """Execute an INSERT or UPDATE ... RETURNING the entity, then commit.
+
+    Server generated columns (id, created_at, updated_at) come back with the
+    write itself instead of a refresh() afterwards. When an UPDATE matches no
+    row the session is rolled back instead, together with anything staged
+    with it, and None is returned.
+    """
+    try:
+        entity = await db.scalar(statement)
+        if entity is None:
+            await db.rollback()
+            return None
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        if integrity_error is None:
+            raise
+        raise ValueError(integrity_error)
+    except Exception:
+        await db.rollback()
+        raise
+    return entity
+
+
+@functools.cache
+def lookup_statement(entity, column: str, load: str | None = None, lowercase: bool = False):
+    """SELECT entity WHERE column = :value LIMIT 1, built once per argument set.
+
+    Reusing the statement object skips rebuilding it and regenerating its
+    cache key, so every lookup after the first goes straight to the compiled
+    SQL in the engine's cache. load names a relationship to selectin load.
+    """
+    key = getattr(entity, column)
+    if lowercase:
+        key = func.lower(key)
+    statement = select(entity).where(key == bindparam("value")).limit(1)
+    if load is not None:
+        # Refresh the relationship of an instance already in the session
+        statement = (statement.options(selectinload(getattr(entity, load)))
+                     .execution_options(populate_existing=True))
+    return statement
+
+
+async def fetch_one(db: AsyncSession, statement, value, not_found: str):
+    """Run a lookup_statement and return its entity, or raise ValueError(not_found)."""
+    entity = (await db.execute(statement, {"value": value})).scalar_one_or_none()
+    if entity is None:
+        raise ValueError(not_found)
+    return entity
+
+
+EXPORT_BATCH_SIZE = 500
+
+
+async def stream_rows(db: AsyncSession, query, related: str | None = None) -> AsyncIterator[dict]:
+    """Stream rows of a query over a server side cursor as dicts.
+
+    When related is given the query must be ordered by id and outer joined to
+    one related column labelled "related". Consecutive rows of the same id are
+    folded into one dict with the related values as a list.
+    """
+    result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    current = None
+    async for row in result.mappings():
+        if related is None:
+            yield dict(row)
+            continue
+        if current is None or current["id"] != row["id"]:
+            if current is not None:
+                yield current
+            current = {key: value for key, value in row.items() if key != "related"}
+            current[related] = []
+        if row["related"] is not None:
+            current[related].append(row["related"])
+    if current is not None:
+        yield current
+
+
 class User(BaseEntity):
     __tablename__ = "users"
     id: Mapped[int] = mapped_column(
         Integer, primary_key=True, autoincrement=True)
-    username: Mapped[str] = mapped_column(String, nullable=False)
+    username: Mapped[str] = mapped_column(String, nullable=False, unique=True, index=True)
     full_name: Mapped[str] = mapped_column(String, nullable=False)
-    email: Mapped[str] = mapped_column(String, nullable=False, unique=True)
+    # Unique through ix_users_email_lower below, which also covers case
+    email: Mapped[str] = mapped_column(String, nullable=False)
     password: Mapped[Optional[str]] = mapped_column(String)
     disabled: Mapped[bool] = mapped_column(Boolean, default=True)
+    # Relationships are never loaded implicitly, queries that need them ask for
+    # them with selectinload so that a response loads exactly one level
     roles: Mapped[List["Role"]] = relationship(
-        "Role", secondary=lambda: association_table, back_populates="users", lazy="selectin")
+        "Role", secondary=lambda: association_table, back_populates="users", lazy="raise_on_sql")
+
+    __table_args__ = (
+        # Emails are unique regardless of case and looked up with lower()
+        Index("ix_users_email_lower", func.lower(email), unique=True),
+    )
 
     @classmethod
-    async def get_all(cls, db: AsyncSession) -> list["User"]:
-        users = (await db.execute(select(cls))).scalars().all()
+    @traced
+    async def get_all(cls, db: AsyncSession, limit: int | None = None, after: int | None = None,
+                      disabled: bool | None = None, username_prefix: str | None = None) -> list["User"]:
+        # Keyset pagination on id, every page is an index range scan
+        query = select(cls).order_by(cls.id)
+        if after is not None:
+            query = query.where(cls.id > after)
+        if disabled is not None:
+            query = query.where(cls.disabled == disabled)
+        if username_prefix:
+            query = query.where(cls.username.startswith(username_prefix, autoescape=True))
+        if limit is not None:
+            query = query.limit(limit)
+        users = (await db.execute(query)).scalars().all()
         return users
 
     @classmethod
+    def export_fields(cls, include_roles: bool = False) -> list[str]:
+        fields = ["id", "uuid", "username", "email", "full_name", "disabled"]
+        return fields + ["roles"] if include_roles else fields
+
+    @classmethod
+    def stream_export(cls, db: AsyncSession, include_roles: bool = False) -> AsyncIterator[dict]:
+        columns = [getattr(cls, field) for field in cls.export_fields()]
+        if not include_roles:
+            return stream_rows(db, select(*columns).order_by(cls.id))
+        query = (select(*columns, Role.name.label("related"))
+                 .outerjoin(association_table, association_table.c.user_id == cls.id)
+                 .outerjoin(Role, Role.id == association_table.c.role_id)
+                 .order_by(cls.id, Role.name))
+        return stream_rows(db, query, "roles")
+
+    @classmethod
+    @traced
     async def create(cls, db: AsyncSession, username: str, full_name: str, email: str) -> "User":
-        user = cls(username=username, full_name=full_name,
-                   email=email, uuid=str(uuid4()))
-        db.add(user)
+        statement = insert(cls).values(username=username, full_name=full_name,
+                                       email=email).returning(cls)
         try:
-            await db.commit()
-            await db.refresh(user)
-        except IntegrityError as error:
-            await db.rollback()
-            raise ValueError("User with that email already exists")
-        except Exception:
-            await db.rollback()
-            raise
-        return user
+            return await write_returning(db, statement)
+        except IntegrityError:
+            raise ValueError(await cls._conflict(db, email))
 
     @classmethod
-    async def get(cls, db: AsyncSession, id: int) -> "User":
+    async def _conflict(cls, db: AsyncSession, email: str | None, id: int | None = None) -> str:
+        # Which unique index a write hit, looked up only once it has failed.
+        # The database reports just one of them and the order differs per backend.
+        if email:
+            query = select(cls.id).where(func.lower(cls.email) == email.lower())
+            if id is not None:
+                query = query.where(cls.id != id)
+            if (await db.execute(query.limit(1))).first():
+                return "User with that email already exists"
+        return "User with that username already exists"
+
+    @classmethod
+    async def _update(cls, db: AsyncSession, id: int, revoke_tokens: bool = False, **values) -> "User":
+        # A token revocation commits with the update, never without it:
+        # write_returning rolls it back when no user matched
+        revocation = None
+        if revoke_tokens:
+            revocation = await RevokedToken.stage_user_revocation(db, id)
+            await RefreshToken.stage_user_revocation(db, id)
+        statement = update(cls).where(cls.id == id).values(**values).returning(cls)
         try:
-            user = await db.get(cls, id)
-            if not user:
-                raise NoResultFound
-        except NoResultFound:
+            user = await write_returning(db, statement)
+        except IntegrityError:
+            raise ValueError(await cls._conflict(db, values.get("email"), id))
+        if user is None:
             raise ValueError("User not found")
+        invalidate_user(id)
+        if revocation is not None:
+            revocation.publish()
         return user
 
     @classmethod
-    async def update(cls, db: AsyncSession, id: int, username: str | None, full_name: str | None, email: str | None) -> "User":
+    @traced
+    async def bulk_create(cls, db: AsyncSession, users: list[dict]) -> list["User | str"]:
+        """Insert many users with one multi-row INSERT ... RETURNING.
+
+        Returns one entry per input, in order: the created User, or an error
+        message for rows whose username or email is already taken (in the
+        table or earlier in the batch). Raises ValueError when the insert
+        hits any other unique constraint, or a username taken concurrently.
+        """
+        results: list["User | str"] = [None] * len(users)
+        rows = []
+        indexes = {}
+        usernames = set()
+        for index, user in enumerate(users):
+            if user["username"] in usernames:
+                results[index] = "User with that username already exists"
+                continue
+            if user["email"].lower() in indexes:
+                results[index] = "User with that email already exists"
+                continue
+            usernames.add(user["username"])
+            indexes[user["email"].lower()] = index
+            rows.append(dict(username=user["username"], full_name=user["full_name"],
+                             email=user["email"], disabled=True))
+
         try:
-            user = await cls.get(db, id)
-            if username:
-                user.username = username
-            if full_name:
-                user.full_name = full_name
-            if email:
-                user.email = email
-            try:
-                await db.commit()
-                await db.refresh(user)
-            except IntegrityError as error:
-                await db.rollback()
-                raise ValueError("User with that email already exists")
+            if rows:
+                # One query over both unique indexes for the names already taken
+                taken = (await db.execute(select(cls.username, func.lower(cls.email)).where(
+                    or_(cls.username.in_(usernames), func.lower(cls.email).in_(indexes))))).all()
+                taken_usernames = {username for username, _ in taken}
+                taken_emails = {email for _, email in taken}
+                for row in rows:
+                    if row["username"] in taken_usernames:
+                        results[indexes[row["email"].lower()]] = "User with that username already exists"
+                    elif row["email"].lower() in taken_emails:
+                        results[indexes[row["email"].lower()]] = "User with that email already exists"
+                rows = [row for row in rows if results[indexes[row["email"].lower()]] is None]
+
+            if rows:
+                # An email taken since the check is skipped, any other conflict raises
+                statement = (dialect_insert(db, cls)
+                             .on_conflict_do_nothing(index_elements=[func.lower(cls.email)])
+                             .returning(cls))
+                for user in (await db.scalars(statement, rows)).all():
+                    results[indexes[user.email.lower()]] = user
+                for row in rows:
+                    if results[indexes[row["email"].lower()]] is None:
+                        results[indexes[row["email"].lower()]] = "User with that email already exists"
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            raise ValueError("Users could not be created, try again")
         except Exception:
             await db.rollback()
             raise
-        return user
+        return results
 
     @classmethod
-    async def set_password(cls, db: AsyncSession, id: int, hashed_password: str | None) -> "User":
-        try:
-            user = await cls.get(db, id)
-            if hashed_password:
-                user.password = hashed_password
-                await db.commit()
-                await db.refresh(user)
-        except Exception:
-            await db.rollback()
-            raise
-        return user
+    @traced
+    async def get(cls, db: AsyncSession, id: int, with_roles: bool = False) -> "User":
+        statement = lookup_statement(cls, "id", "roles" if with_roles else None)
+        return await fetch_one(db, statement, id, "User not found")
+
+    @classmethod
+    @traced
+    async def update(cls, db: AsyncSession, id: int, username: str | None, full_name: str | None, email: str | None) -> "User":
+        values = {field: value for field, value in
+                  (("username", username), ("full_name", full_name), ("email", email)) if value}
+        if not values:
+            return await cls.get(db, id)
+        return await cls._update(db, id, **values)
+
+    @classmethod
+    @traced
+    async def set_password(cls, db: AsyncSession, id: int, hashed_password: str | None,
+                           revoke_tokens: bool = True) -> "User":
+        # revoke_tokens=False is for rehashing the same password
+        if not hashed_password:
+            return await cls.get(db, id)
+        return await cls._update(db, id, revoke_tokens=revoke_tokens, password=hashed_password)
 
     @classmethod
+    @traced
     async def delete(cls, db: AsyncSession, id: int) -> None:
         try:
-            user = await cls.get(db, id)
+            user = await cls.get(db, id, with_roles=True)
+            # Also done by the foreign key's ON DELETE CASCADE, which SQLite
+            # only enforces with PRAGMA foreign_keys
+            await RefreshToken.stage_user_revocation(db, id)
             await db.delete(user)
             await db.commit()
         except NoResultFound:
             raise ValueError("User not found")
+        invalidate_user(id)
         return {"detail": "User deleted"}
 
     @classmethod
-    async def get_user_by_uuid(cls, db: AsyncSession, uuid: uuid4) -> "User":
-        try:
-            user = (await db.execute(select(cls).where(cls.uuid == uuid))).scalars().first()
-            if not user:
-                raise NoResultFound
-        except NoResultFound:
-            raise ValueError("User not found")
-        return user
+    @traced
+    async def get_user_by_uuid(cls, db: AsyncSession, uuid: UUID) -> "User":
+        return await fetch_one(db, lookup_statement(cls, "uuid"), uuid, "User not found")
 
     @classmethod
+    @traced
     async def get_user_by_username(cls, db: AsyncSession, username: str) -> "User":
-        try:
-            user = (await db.execute(select(cls).where(cls.username == username))).scalars().first()
-            if not user:
-                raise NoResultFound
-        except NoResultFound:
-            raise ValueError("User not found")
-        return user
+        return await fetch_one(db, lookup_statement(cls, "username"), username, "User not found")
+
+    @classmethod
+    @traced
+    async def get_user_by_email(cls, db: AsyncSession, email: str) -> "User":
+        # Matches ix_users_email_lower
+        statement = lookup_statement(cls, "email", lowercase=True)
+        return await fetch_one(db, statement, email.lower(), "User not found")
 
     @classmethod
+    @traced
     async def add_role(cls, db: AsyncSession, user_id: int, role_id: int) -> "User":
         try:
             try:
-                user = await cls.get(db, user_id)
+                user = await cls.get(db, user_id, with_roles=True)
                 if not user:
                     raise NoResultFound
             except NoResultFound:
@@ -153,37 +353,42 @@ class User(BaseEntity):
             user.roles.append(role)
             try:
                 await db.commit()
-                await db.refresh(user)
             except IntegrityError as error:
                 await db.rollback()
                 raise ValueError("User -> Role association already exists")
         except Exception:
             raise
+        invalidate_user(user_id)
         return user
 
     @classmethod
+    @traced
+    async def role_names(cls, db: AsyncSession, id: int) -> frozenset[str]:
+        # Only the names, through the (user_id, role_id) unique index
+        query = (select(Role.name)
+                 .join(association_table, association_table.c.role_id == Role.id)
+                 .where(association_table.c.user_id == id))
+        return frozenset((await db.scalars(query)).all())
+
+    @classmethod
+    @traced
+    async def assign_roles(cls, db: AsyncSession, user_id: int, role_ids: list[int]) -> list[tuple[int, int, str]]:
+        return await assign_pairs(db, [user_id], role_ids)
+
+    @classmethod
+    @traced
+    async def revoke_roles(cls, db: AsyncSession, user_id: int, role_ids: list[int]) -> list[tuple[int, int, str]]:
+        return await revoke_pairs(db, [user_id], role_ids)
+
+    @classmethod
+    @traced
     async def activate(cls, db: AsyncSession, id: int) -> "User":
-        try:
-            user = await cls.get(db, id)
-            user.disabled = False
-            await db.commit()
-            await db.refresh(user)
-        except Exception:
-            await db.rollback()
-            raise
-        return user
+        return await cls._update(db, id, disabled=False)
 
     @classmethod
+    @traced
     async def deactivate(cls, db: AsyncSession, id: int) -> "User":
-        try:
-            user = await cls.get(db, id)
-            user.disabled = True
-            await db.commit()
-            await db.refresh(user)
-        except Exception:
-            await db.rollback()
-            raise
-        return user
+        return await cls._update(db, id, revoke_tokens=True, disabled=True)
 
 
 class Role(BaseEntity):
@@ -192,84 +397,93 @@ class Role(BaseEntity):
     description: str = Column(String, nullable=True)
     disabled: bool = Column(Boolean, default=True)
     users: Mapped[list["User"]] = relationship(
-        "User", secondary=lambda: association_table, back_populates="roles", lazy="selectin")
+        "User", secondary=lambda: association_table, back_populates="roles", lazy="raise_on_sql")
 
     @classmethod
-    async def get_all(cls, db: AsyncSession) -> list["Role"]:
-        roles = (await db.execute(select(cls))).scalars().all()
+    @traced
+    async def get_all(cls, db: AsyncSession, limit: int | None = None, after: int | None = None,
+                      disabled: bool | None = None, name_prefix: str | None = None) -> list["Role"]:
+        query = select(cls).order_by(cls.id)
+        if after is not None:
+            query = query.where(cls.id > after)
+        if disabled is not None:
+            query = query.where(cls.disabled == disabled)
+        if name_prefix:
+            query = query.where(cls.name.startswith(name_prefix, autoescape=True))
+        if limit is not None:
+            query = query.limit(limit)
+        roles = (await db.execute(query)).scalars().all()
         return roles
 
     @classmethod
+    def export_fields(cls, include_users: bool = False) -> list[str]:
+        fields = ["id", "uuid", "name", "description", "disabled"]
+        return fields + ["users"] if include_users else fields
+
+    @classmethod
+    def stream_export(cls, db: AsyncSession, include_users: bool = False) -> AsyncIterator[dict]:
+        columns = [getattr(cls, field) for field in cls.export_fields()]
+        if not include_users:
+            return stream_rows(db, select(*columns).order_by(cls.id))
+        query = (select(*columns, User.username.label("related"))
+                 .outerjoin(association_table, association_table.c.role_id == cls.id)
+                 .outerjoin(User, User.id == association_table.c.user_id)
+                 .order_by(cls.id, User.username))
+        return stream_rows(db, query, "users")
+
+    @classmethod
+    @traced
     async def create(cls, db: AsyncSession, name: str, description: str) -> "Role":
-        role = cls(name=name, description=description, uuid=str(uuid4()))
-        db.add(role)
-        try:
-            await db.commit()
-            await db.refresh(role)
-        except IntegrityError:
-            await db.rollback()
-            raise ValueError("Role with that name already exists")
-        return role
+        statement = insert(cls).values(name=name, description=description).returning(cls)
+        return await write_returning(db, statement, "Role with that name already exists")
 
     @classmethod
-    async def get(cls, db: AsyncSession, id: int) -> "Role":
-        try:
-            role = await db.get(cls, id)
-            if not role:
-                raise NoResultFound
-        except NoResultFound:
-            raise ValueError("Role not found")
-        return role
+    @traced
+    async def get(cls, db: AsyncSession, id: int, with_users: bool = False) -> "Role":
+        statement = lookup_statement(cls, "id", "users" if with_users else None)
+        return await fetch_one(db, statement, id, "Role not found")
 
     @classmethod
+    @traced
     async def update(cls, db: AsyncSession, id: int, name: str | None, description: str | None) -> "Role":
-        try:
-            role = await cls.get(db, id)
-            if name:
-                role.name = name
-            if description:
-                role.description = description
-            try:
-                await db.commit()
-                await db.refresh(role)
-            except IntegrityError as error:
-                await db.rollback()
-                raise ValueError("Role with that name already exists")
-        except Exception:
-            await db.rollback()
-            raise
+        values = {field: value for field, value in
+                  (("name", name), ("description", description)) if value}
+        if not values:
+            return await cls.get(db, id)
+        statement = update(cls).where(cls.id == id).values(**values).returning(cls)
+        role = await write_returning(db, statement, "Role with that name already exists")
+        if role is None:
+            raise ValueError("Role not found")
+        if "name" in values:
+            invalidate_roles()
         return role
 
     @classmethod
+    @traced
     async def delete(cls, db: AsyncSession, id: int) -> None:
         try:
-            role = await cls.get(db, id)
+            role = await cls.get(db, id, with_users=True)
             await db.delete(role)
             await db.commit()
         except NoResultFound:
             raise ValueError("Role not found")
+        invalidate_roles()
         return {"detail": "Role deleted"}
 
-    @ classmethod
-    async def get_role_by_uuid(cls, db: AsyncSession, uuid: str) -> "Role":
-        try:
-            roles = (await db.execute(select(cls).where(cls.uuid == uuid))).scalars().all()
-            if len(roles) == 0:
-                raise NoResultFound
-            else:
-                role = roles[0]
-        except NoResultFound:
-            raise ValueError("Role not found")
-        return role
+    @classmethod
+    @traced
+    async def get_role_by_uuid(cls, db: AsyncSession, uuid: UUID) -> "Role":
+        return await fetch_one(db, lookup_statement(cls, "uuid"), uuid, "Role not found")
 
     def __str__(self):
         return f"name='{self.name}', description='{self.description}', uuid='{self.uuid}', disabled='{self.disabled}'"
 
     @classmethod
+    @traced
     async def remove_user_from_role(cls, db: AsyncSession, user_id: int, role_id: int) -> None:
         try:
             try:
-                user = await User.get(db, user_id)
+                user = await User.get(db, user_id, with_roles=True)
                 if not user:
                     raise NoResultFound
             except NoResultFound:
@@ -294,4 +508,95 @@ class Role(BaseEntity):
                 raise ValueError("User - Role association does not exist")
         except Exception:
             raise
+        invalidate_user(user_id)
         return {"detail": "User removed from role"}
+
+    @classmethod
+    @traced
+    async def assign_users(cls, db: AsyncSession, role_id: int, user_ids: list[int]) -> list[tuple[int, int, str]]:
+        return await assign_pairs(db, user_ids, [role_id])
+
+    @classmethod
+    @traced
+    async def revoke_users(cls, db: AsyncSession, role_id: int, user_ids: list[int]) -> list[tuple[int, int, str]]:
+        return await revoke_pairs(db, user_ids, [role_id])
+
+
+async def existing_ids(db: AsyncSession, user_ids: list[int], role_ids: list[int]) -> tuple[set[int], set[int]]:
+    users = set((await db.scalars(select(User.id).where(User.id.in_(user_ids)))).all())
+    roles = set((await db.scalars(select(Role.id).where(Role.id.in_(role_ids)))).all())
+    return users, roles
+
+
+def pair_results(pairs: list[tuple[int, int]], users: set[int], roles: set[int],
+                 changed: set[tuple[int, int]], changed_detail: str, unchanged_detail: str) -> list[tuple[int, int, str]]:
+    results = []
+    for user_id, role_id in pairs:
+        if user_id not in users:
+            detail = "User not found"
+        elif role_id not in roles:
+            detail = "Role not found"
+        elif (user_id, role_id) in changed:
+            detail = changed_detail
+        else:
+            detail = unchanged_detail
+        results.append((user_id, role_id, detail))
+    return results
+
+
+async def assign_pairs(db: AsyncSession, user_ids: list[int], role_ids: list[int]) -> list[tuple[int, int, str]]:
+    """Add every user to every role with one INSERT ... ON CONFLICT DO NOTHING.
+
+    Returns (user_id, role_id, detail) for each pair, in input order. A user
+    or role deleted between the existence check and the insert fails the
+    foreign key, the check and insert are then run once more so that its
+    pairs are reported as not found.
+    """
+    user_ids, role_ids = list(dict.fromkeys(user_ids)), list(dict.fromkeys(role_ids))
+    pairs = [(user_id, role_id) for user_id in user_ids for role_id in role_ids]
+    for attempt in range(2):
+        try:
+            users, roles = await existing_ids(db, user_ids, role_ids)
+            rows = [{"user_id": user_id, "role_id": role_id} for user_id, role_id in pairs
+                    if user_id in users and role_id in roles]
+            inserted = set()
+            if rows:
+                statement = (dialect_insert(db, association_table).values(rows).on_conflict_do_nothing()
+                             .returning(association_table.c.user_id, association_table.c.role_id))
+                inserted = set(tuple(row) for row in (await db.execute(statement)).all())
+            await db.commit()
+            break
+        except IntegrityError:
+            await db.rollback()
+            if attempt:
+                raise
+        except Exception:
+            await db.rollback()
+            raise
+    for user_id in set(user_id for user_id, _ in inserted):
+        invalidate_user(user_id)
+    return pair_results(pairs, users, roles, inserted,
+                        "User added to role", "User -> Role association already exists")
+
+
+async def revoke_pairs(db: AsyncSession, user_ids: list[int], role_ids: list[int]) -> list[tuple[int, int, str]]:
+    """Remove every user from every role with one DELETE ... RETURNING.
+
+    Returns (user_id, role_id, detail) for each pair, in input order.
+    """
+    user_ids, role_ids = list(dict.fromkeys(user_ids)), list(dict.fromkeys(role_ids))
+    pairs = [(user_id, role_id) for user_id in user_ids for role_id in role_ids]
+    try:
+        users, roles = await existing_ids(db, user_ids, role_ids)
+        statement = (delete(association_table)
+                     .where(association_table.c.user_id.in_(user_ids), association_table.c.role_id.in_(role_ids))
+                     .returning(association_table.c.user_id, association_table.c.role_id))
+        deleted = set(tuple(row) for row in (await db.execute(statement)).all())
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    for user_id in set(user_id for user_id, _ in deleted):
+        invalidate_user(user_id)
+    return pair_results(pairs, users, roles, deleted,
+                        "User removed from role", "User - Role association does not exist")
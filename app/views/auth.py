@@ -1,28 +1,33 @@
+import math
+import time
 from typing import Annotated
 from uuid import uuid4
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlalchemy.exc import NoResultFound
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
 from datetime import datetime, timedelta, UTC
 
 from app.sqlalchemy_models.user import User as SqlUser
+from app.sqlalchemy_models.token import RevokedToken, RefreshToken
 
-import jwt
 from jwt.exceptions import InvalidTokenError
 from pydantic import BaseModel
-from app.pydantic_models.user import User, UserInDB
+from app.pydantic_models.user import User, UserInDB, CurrentUser
+from app.services.cache import principal_cache, role_cache, token_cache
 from app.services.database import sessionmanager, get_db
+from app.services.keys import keyring
+from app.services.password import password_hasher, PasswordHasherBusy
+from app.services.ratelimit import login_limiter
+from app.services.revocation import revocation_list
 from app.config import get_config
 
 
 config = get_config()
 
-secret_key = config['secret_key']
-algorithm = config['algorithm']
 access_token_expire_minutes = config['access_token_expire_minutes']
+refresh_token_expire_days = config.get('refresh_token_expire_days', 30)
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -30,23 +35,30 @@ router = APIRouter(prefix="/auth", tags=["auth"])
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: str | None = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
     username: str | None = None
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/token")
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 
-def verify_pasword(submitted_password, hashed_password):
-    get_password_hash(submitted_password)
-    return pwd_context.verify(submitted_password, hashed_password)
+def busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many authentication requests, try again later",
+        headers={"Retry-After": "1"},
+    )
 
 
 async def get_user_by_username(username: str):
@@ -69,54 +81,110 @@ async def get_user(username: str):
 
 async def authenticate_user(username: str, password: str):
     user = await get_user(username)
-    if not user:
+    if not user or not user.password:
         raise ValueError("Incorrect username or password")
-    if not verify_pasword(password, user.password):
+    verified, new_hash = await password_hasher.verify_and_update(password, user.password)
+    if not verified:
         raise ValueError("Incorrect username or password")
+    if new_hash:
+        # Stored hash uses outdated settings, upgrade it while we have the password
+        async with sessionmanager.session() as session:
+            await SqlUser.set_password(session, user.id, new_hash, revoke_tokens=False)
     return user
 
 
 async def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
+    now = datetime.now(UTC)
     if expires_delta:
-        expire = datetime.now(UTC) + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.now(UTC) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, secret_key,
-                             algorithm=algorithm)
+        expire = now + timedelta(minutes=15)
+    # iat keeps its fraction, revocations compare it to the revocation time
+    to_encode.update({"exp": expire, "iat": now.timestamp(), "jti": uuid4().hex})
+    encoded_jwt = keyring.sign(to_encode)
     return encoded_jwt
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+async def get_current_user(request: Request, token: Annotated[str, Depends(oauth2_scheme)]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid authentication credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    route = request.scope.get("route")
     try:
-        payload = jwt.decode(token, secret_key, algorithms=[
-                             algorithm])
+        # A reload of the keys clears the token cache
+        keyring.refresh()
+        payload = token_cache.get(token, route.path if route else request.url.path)
+        if payload is None:
+            start = time.perf_counter()
+            payload = keyring.decode(token)
+            token_cache.put(token, payload, time.perf_counter() - start)
         username = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
     except InvalidTokenError:
         raise credentials_exception
-    user = await get_user_by_username(token_data.username)
+    user, generation = principal_cache.get(token_data.username)
     if user is None:
+        try:
+            user = CurrentUser.model_validate(await get_user_by_username(token_data.username))
+        except ValueError:
+            raise credentials_exception
+        principal_cache.put(user, generation)
+    if revocation_list.is_revoked(payload, user.id):
         raise credentials_exception
+    request.state.token_claims = payload
     return user
 
 
-async def get_current_active_user(current_user: Annotated[SqlUser, Depends(get_current_user)]):
+async def get_current_active_user(current_user: Annotated[CurrentUser, Depends(get_current_user)]):
     if current_user.disabled:
         raise HTTPException(status_code=401, detail="Inactive user")
     return current_user
 
 
+async def get_current_user_roles(current_user: Annotated[CurrentUser, Depends(get_current_active_user)]) -> frozenset[str]:
+    roles, generation = role_cache.get(current_user.id)
+    if roles is None:
+        async with sessionmanager.session() as session:
+            roles = await SqlUser.role_names(session, current_user.id)
+        role_cache.put(current_user.id, roles, generation)
+    return roles
+
+
+def require_roles(*roles: str):
+    """Dependency for routes that need all of the given role names.
+
+    Use as ``dependencies=[Depends(require_roles("admin"))]`` on a route or
+    router. The role names come from role_cache, so repeated checks for the
+    same user do not touch the database.
+    """
+    required = frozenset(roles)
+
+    async def check_roles(current_user: Annotated[CurrentUser, Depends(get_current_active_user)],
+                          user_roles: Annotated[frozenset[str], Depends(get_current_user_roles)]):
+        if not required <= user_roles:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+        return current_user
+
+    return check_roles
+
+
 @router.post("/token")
-async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token:
+async def login(request: Request, form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> Token:
+    # Before the user lookup and bcrypt, which are what an attacker would exhaust
+    ip = login_limiter.client_ip(request.client.host if request.client else None,
+                                 request.headers.get("x-forwarded-for"))
+    wait = await login_limiter.check(ip, form_data.username)
+    if wait > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many login attempts, try again later",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
     try:
         user = await authenticate_user(form_data.username, form_data.password)
         if user.disabled:
@@ -131,14 +199,68 @@ async def login(form_data: Annotated[OAuth2PasswordRequestForm, Depends()]) -> T
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return Token(access_token=access_token, token_type="bearer")
+    except PasswordHasherBusy:
+        raise busy_exception()
+    async with sessionmanager.session() as session:
+        refresh_token = await RefreshToken.issue(session, user.id, refresh_token_expires_at())
+    return Token(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
+
+
+def refresh_token_expires_at() -> datetime:
+    return datetime.now(UTC) + timedelta(days=refresh_token_expire_days)
+
+
+@router.post("/refresh")
+async def refresh(body: RefreshRequest, db: AsyncSession = Depends(get_db)) -> Token:
+    """Trade a refresh token for a new access token and the next refresh
+    token, without a password check. A refresh token works once, using it
+    again revokes every token descended from the same login. The family
+    expires refresh_token_expire_days after that login."""
+    invalid_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        # Checked before the rotation, so that an inactive user's token is not used up
+        user = await SqlUser.get(db, await RefreshToken.owner(db, body.refresh_token))
+        if user.disabled:
+            raise HTTPException(status_code=401, detail="Inactive user")
+        _, refresh_token = await RefreshToken.rotate(db, body.refresh_token)
+    except ValueError:
+        raise invalid_exception
+    access_token = await create_access_token(
+        data={"sub": user.username}, expires_delta=timedelta(minutes=access_token_expire_minutes)
+    )
+    return Token(access_token=access_token, token_type="bearer", refresh_token=refresh_token)
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(request: Request, current_user: Annotated[CurrentUser, Depends(get_current_user)],
+                 db: AsyncSession = Depends(get_db)):
+    claims = request.state.token_claims
+    if "jti" not in claims:
+        raise HTTPException(status_code=400, detail="Token cannot be revoked")
+    await RevokedToken.revoke_token(db, claims["jti"], datetime.fromtimestamp(claims["exp"], UTC))
+
+
+@router.get("/jwks")
+async def get_jwks(response: Response):
+    # Verifying services cache the key set, new keys are picked up within reload_seconds
+    response.headers["Cache-Control"] = f"public, max-age={int(keyring.reload_seconds)}"
+    return keyring.jwks()
 
 
 @ router.get("/me", response_model=User)
-async def get_user_me(current_user: Annotated[SqlUser, Depends(get_current_active_user)]):
+async def get_user_me(current_user: Annotated[CurrentUser, Depends(get_current_active_user)]):
     return current_user
 
 
+@router.get("/me/roles", response_model=list[str])
+async def get_user_me_roles(roles: Annotated[frozenset[str], Depends(get_current_user_roles)]):
+    return sorted(roles)
+
+
 class Password(BaseModel):
     password: str
 
@@ -148,8 +270,10 @@ async def set_password(id: int, password: Password, db: AsyncSession = Depends(g
     # if config['config_name'] != 'testing':
     #     raise HTTPException(status_code=404, detail="Not found")
     try:
-        hashed_password = get_password_hash(password.password)
+        hashed_password = await get_password_hash(password.password)
         user = await SqlUser.set_password(db, id, hashed_password)
     except NoResultFound:
         raise HTTPException(status_code=400, detail="User not found")
+    except PasswordHasherBusy:
+        raise busy_exception()
     return user
@@ -0,0 +1,28 @@
+from fastapi import Response
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def page_limit(limit: int | None, after: int | None) -> int | None:
+    """Number of items on the requested page, None for the whole list.
+
+    Paging is opt-in so that clients that expect every row keep getting
+    them. A request with after but no limit gets a page of DEFAULT_PAGE_SIZE.
+    """
+    if limit is None and after is not None:
+        return DEFAULT_PAGE_SIZE
+    return limit
+
+
+def paginate(response: Response, items: list, limit: int | None) -> list:
+    """Trim a page fetched with limit + 1 rows and advertise the next cursor.
+
+    The cursor is the id of the last item on the page and goes in the
+    X-Next-Cursor header so that the body stays a plain JSON array.
+    """
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        response.headers["X-Next-Cursor"] = str(items[-1].id)
+    return items
@@ -1,21 +1,28 @@
 # Standard libary imports
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic.types import UUID4
 
 # App imports
-from app.services.database import get_db
+from app.services.database import sessionmanager, get_db, get_db_read
+from app.services.export import export_chunks, EXPORT_MEDIA_TYPES
+from app.views.pagination import page_limit, paginate, MAX_PAGE_SIZE
 from app.sqlalchemy_models.user import User as SqlUser
 from app.sqlalchemy_models.user import Role as SqlRole
-from app.pydantic_models.user import RoleCreate, RoleUpdate, Role, RoleWithUsers
-from typing import Any
+from app.pydantic_models.user import RoleCreate, RoleUpdate, Role, RoleWithUsers, UserIds, RoleAssignment
+from typing import Any, Literal
 
 router = APIRouter(prefix="/roles", tags=["roles"])
 
 
 @router.get("/", response_model=list[Role])
-async def get_all_roles(db: AsyncSession = Depends(get_db)):
-    roles = await SqlRole.get_all(db)
-    return roles
+async def get_all_roles(response: Response, limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                        after: int | None = None, disabled: bool | None = None,
+                        name_prefix: str | None = None, db: AsyncSession = Depends(get_db_read)):
+    limit = page_limit(limit, after)
+    roles = await SqlRole.get_all(db, None if limit is None else limit + 1, after, disabled, name_prefix)
+    return paginate(response, roles, limit)
 
 
 @router.post("/", response_model=Role, status_code=status.HTTP_201_CREATED)
@@ -48,8 +55,19 @@ async def delete_role(id: int, db: AsyncSession = Depends(get_db)):
     return {"detail": "Role deleted"}
 
 
+@router.get("/export")
+async def export_roles(format: Literal["ndjson", "csv"] = "ndjson", include_users: bool = False):
+    async def roles():
+        async with sessionmanager.read_session() as db:
+            async for role in SqlRole.stream_export(db, include_users):
+                yield role
+
+    return StreamingResponse(export_chunks(roles(), format, SqlRole.export_fields(include_users)),
+                             media_type=EXPORT_MEDIA_TYPES[format])
+
+
 @router.get("/{id}", response_model=Role)
-async def get_role_by_id(id: int, db: AsyncSession = Depends(get_db)):
+async def get_role_by_id(id: int, db: AsyncSession = Depends(get_db_read)):
     try:
         role = await SqlRole.get(db, id)
     except ValueError as error:
@@ -59,7 +77,7 @@ async def get_role_by_id(id: int, db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/uuid/{uuid}", response_model=Role)
-async def get_role_by_uuid(uuid: str, db: AsyncSession = Depends(get_db)):
+async def get_role_by_uuid(uuid: UUID4, db: AsyncSession = Depends(get_db_read)):
     try:
         role = await SqlRole.get_role_by_uuid(db, uuid)
     except ValueError as error:
@@ -72,16 +90,16 @@ async def get_role_by_uuid(uuid: str, db: AsyncSession = Depends(get_db)):
 async def add_user_to_role(user_id: int, role_id: int, db: AsyncSession = Depends(get_db)):
     try:
         await SqlUser.add_role(db, user_id, role_id)
-        role = await SqlRole.get(db, role_id)
+        role = await SqlRole.get(db, role_id, with_users=True)
     except ValueError as error:
         raise HTTPException(status_code=400, detail=str(error))
     return role
 
 
 @router.get("/{role_id}/users", response_model=RoleWithUsers)
-async def get_users_in_role(role_id: int, db: AsyncSession = Depends(get_db)):
+async def get_users_in_role(role_id: int, db: AsyncSession = Depends(get_db_read)):
     try:
-        role = await SqlRole.get(db, role_id)
+        role = await SqlRole.get(db, role_id, with_users=True)
     except ValueError as error:
         raise HTTPException(status_code=404, detail=str(error))
     return role
@@ -94,3 +112,17 @@ async def remove_user_from_role(user_id: int, role_id: int, db: AsyncSession = D
     except ValueError as error:
         raise HTTPException(status_code=400, detail=str(error))
     return {"detail": "User removed from role"}
+
+
+@router.post("/{role_id}/users", response_model=list[RoleAssignment])
+async def add_users_to_role(role_id: int, users: UserIds, db: AsyncSession = Depends(get_db)):
+    results = await SqlRole.assign_users(db, role_id, users.user_ids)
+    return [RoleAssignment(user_id=user_id, role_id=role_id, detail=detail)
+            for user_id, role_id, detail in results]
+
+
+@router.post("/{role_id}/users/revoke", response_model=list[RoleAssignment])
+async def remove_users_from_role(role_id: int, users: UserIds, db: AsyncSession = Depends(get_db)):
+    results = await SqlRole.revoke_users(db, role_id, users.user_ids)
+    return [RoleAssignment(user_id=user_id, role_id=role_id, detail=detail)
+            for user_id, role_id, detail in results]
@@ -0,0 +1,37 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.services.cache import principal_cache, role_cache, token_cache
+from app.services.database import sessionmanager
+from app.services.invalidation import invalidation_bus
+from app.services.metrics import metrics_registry
+from app.services.password import password_hasher
+from app.services.ratelimit import login_limiter
+from app.services.revocation import revocation_list
+from app.services.slow_queries import slow_query_log
+
+router = APIRouter(prefix="/stats", tags=["stats"])
+
+
+@router.get("/auth")
+async def get_auth_stats():
+    return {
+        "principal_cache": principal_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "role_cache": role_cache.stats(),
+        "invalidation": invalidation_bus.stats(),
+        "revocation_list": revocation_list.stats(),
+        "password_hasher": password_hasher.stats(),
+        "login_limiter": login_limiter.stats(),
+    }
+
+
+@router.get("/db")
+async def get_db_stats():
+    return dict(sessionmanager.pool_stats(), slow_queries=slow_query_log.stats())
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request metrics in the Prometheus text format."""
+    return metrics_registry.render()
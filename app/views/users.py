@@ -1,22 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from uuid import uuid4
+from pydantic.types import UUID4
 
 from app.config import get_config
-from app.services.database import get_db
-from app.pydantic_models.user import User, UserCreate, UserUpdate, UserWithRoles
+from app.services.database import sessionmanager, get_db, get_db_read
+from app.services.export import export_chunks, EXPORT_MEDIA_TYPES
+from app.views.pagination import page_limit, paginate, MAX_PAGE_SIZE
+from app.pydantic_models.user import User, UserCreate, UserUpdate, UserWithRoles, BulkUserResult, RoleIds, RoleAssignment
 from app.sqlalchemy_models.user import User as SqlUser, Role as SqlRole
-from typing import Any
+from typing import Any, Literal
 
 
 config = get_config()
 router = APIRouter(prefix="/users", tags=["users"])
 
+# Users per POST /users/bulk, one multi-row INSERT
+MAX_BULK_USERS = 1000
+
 
 @router.get("/", response_model=list[User])
-async def get_users(db: AsyncSession = Depends(get_db)):
-    users = await SqlUser.get_all(db)
-    return users
+async def get_users(response: Response, limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+                    after: int | None = None, disabled: bool | None = None,
+                    username_prefix: str | None = None, db: AsyncSession = Depends(get_db_read)):
+    limit = page_limit(limit, after)
+    users = await SqlUser.get_all(db, None if limit is None else limit + 1, after, disabled, username_prefix)
+    return paginate(response, users, limit)
 
 
 @router.post("/", response_model=User, status_code=status.HTTP_201_CREATED)
@@ -29,8 +38,31 @@ async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     return user
 
 
+@router.post("/bulk", response_model=list[BulkUserResult])
+async def create_users(users: list[UserCreate] = Body(max_length=MAX_BULK_USERS), db: AsyncSession = Depends(get_db)):
+    try:
+        created = await SqlUser.bulk_create(db, [user.model_dump() for user in users])
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return [BulkUserResult(index=index, detail=result) if isinstance(result, str)
+               else BulkUserResult(index=index, user=User.model_validate(result))
+               for index, result in enumerate(created)]
+
+
+@router.get("/export")
+async def export_users(format: Literal["ndjson", "csv"] = "ndjson", include_roles: bool = False):
+    # The session is opened inside the generator so it lives as long as the stream
+    async def users():
+        async with sessionmanager.read_session() as db:
+            async for user in SqlUser.stream_export(db, include_roles):
+                yield user
+
+    return StreamingResponse(export_chunks(users(), format, SqlUser.export_fields(include_roles)),
+                             media_type=EXPORT_MEDIA_TYPES[format])
+
+
 @router.get("/{id}", response_model=User)
-async def get_user(id: int, db: AsyncSession = Depends(get_db)):
+async def get_user(id: int, db: AsyncSession = Depends(get_db_read)):
     try:
         user = await SqlUser.get(db, id)
     except ValueError as error:
@@ -61,7 +93,7 @@ async def delete_user(id: int, db: AsyncSession = Depends(get_db)):
 
 
 @router.get("/username/{username}", response_model=User)
-async def get_user_by_username(username: str, db: AsyncSession = Depends(get_db)):
+async def get_user_by_username(username: str, db: AsyncSession = Depends(get_db_read)):
     try:
         user = await SqlUser.get_user_by_username(db, username)
     except ValueError as error:
@@ -70,8 +102,18 @@ async def get_user_by_username(username: str, db: AsyncSession = Depends(get_db)
     return user
 
 
+@router.get("/email/{email}", response_model=User)
+async def get_user_by_email(email: str, db: AsyncSession = Depends(get_db_read)):
+    try:
+        user = await SqlUser.get_user_by_email(db, email)
+    except ValueError as error:
+        raise HTTPException(
+            status_code=400, detail=str(error))
+    return user
+
+
 @router.get("/uuid/{uuid}", response_model=User)
-async def get_user_by_uuid(uuid: str, db: AsyncSession = Depends(get_db)):
+async def get_user_by_uuid(uuid: UUID4, db: AsyncSession = Depends(get_db_read)):
     try:
         user = await SqlUser.get_user_by_uuid(db, uuid)
     except ValueError as error:
@@ -91,15 +133,29 @@ async def add_role_for_user(user_id: int, role_id: int, db: AsyncSession = Depen
 
 
 @router.get("/{id}/roles", response_model=UserWithRoles)
-async def get_user_with_roles(id: int, db: AsyncSession = Depends(get_db)):
+async def get_user_with_roles(id: int, db: AsyncSession = Depends(get_db_read)):
     try:
-        user = await SqlUser.get(db, id)
+        user = await SqlUser.get(db, id, with_roles=True)
     except ValueError as error:
         raise HTTPException(
             status_code=400, detail=str(error))
     return user
 
 
+@router.post("/{user_id}/roles", response_model=list[RoleAssignment])
+async def add_roles_for_user(user_id: int, roles: RoleIds, db: AsyncSession = Depends(get_db)):
+    results = await SqlUser.assign_roles(db, user_id, roles.role_ids)
+    return [RoleAssignment(user_id=user_id, role_id=role_id, detail=detail)
+            for user_id, role_id, detail in results]
+
+
+@router.post("/{user_id}/roles/revoke", response_model=list[RoleAssignment])
+async def remove_roles_for_user(user_id: int, roles: RoleIds, db: AsyncSession = Depends(get_db)):
+    results = await SqlUser.revoke_roles(db, user_id, roles.role_ids)
+    return [RoleAssignment(user_id=user_id, role_id=role_id, detail=detail)
+            for user_id, role_id, detail in results]
+
+
 @router.delete("/{user_id}/role/{role_id}", response_model=Any)
 async def remove_role_for_user(user_id: int, role_id: int, db: AsyncSession = Depends(get_db)):
     try:
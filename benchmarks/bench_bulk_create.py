@@ -0,0 +1,53 @@
+"""Users per second: one POST /api/users/ per user against POST /api/users/bulk.
+
+Run with ``python -m benchmarks.bench_bulk_create <config.json> [count]`` from
+the project root. The tables of the configured database are dropped and
+recreated, so point it at a scratch database.
+"""
+import asyncio
+import sys
+import time
+
+from httpx import AsyncClient
+
+from app import init_app
+from app.services.database import sessionmanager
+
+
+def new_users(prefix, count):
+    return [{
+        'username': f'{prefix}{index}',
+        'email': f'{prefix}{index}@example.com',
+        'full_name': f'Benchmark User {index}',
+    } for index in range(count)]
+
+
+async def main(config_file: str, count: int):
+    app = init_app(config_file)
+    async with sessionmanager.connect() as connection:
+        await sessionmanager.drop_all(connection)
+        await sessionmanager.create_all(connection)
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        start = time.perf_counter()
+        for user in new_users('single', count):
+            response = await client.post('/api/users/', json=user)
+            assert response.status_code == 201
+        single_rate = count / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        users = new_users('bulk', count)
+        for offset in range(0, count, 1000):
+            response = await client.post('/api/users/bulk', json=users[offset:offset + 1000])
+            assert response.status_code == 200
+        bulk_rate = count / (time.perf_counter() - start)
+
+    await sessionmanager.close()
+
+    print(f"single inserts : {single_rate:10.1f} users/s")
+    print(f"bulk insert    : {bulk_rate:10.1f} users/s")
+    print(f"speedup        : {bulk_rate / single_rate:10.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000))
@@ -0,0 +1,41 @@
+"""Logins per core: the old verify path (hash + verify) against a single verify.
+
+Run with ``python -m benchmarks.bench_login_verify [rounds]`` from the project root.
+"""
+import sys
+import time
+
+from app.services.password import pwd_context, _verify_and_update
+
+
+def old_login_path(password, hashed_password):
+    pwd_context.hash(password)
+    return pwd_context.verify(password, hashed_password)
+
+
+def new_login_path(password, hashed_password):
+    verified, _ = _verify_and_update(password, hashed_password)
+    return verified
+
+
+def logins_per_second(login, rounds, password, hashed_password):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        assert login(password, hashed_password)
+    return rounds / (time.perf_counter() - start)
+
+
+def main(rounds: int = 20):
+    password = "test!wer1"
+    hashed_password = pwd_context.hash(password)
+
+    old_rate = logins_per_second(old_login_path, rounds, password, hashed_password)
+    new_rate = logins_per_second(new_login_path, rounds, password, hashed_password)
+
+    print(f"hash + verify : {old_rate:8.2f} logins/s per core")
+    print(f"single verify : {new_rate:8.2f} logins/s per core")
+    print(f"speedup       : {new_rate / old_rate:8.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,53 @@
+"""Token renewals per second: a password login against a refresh token grant.
+
+Run with ``python -m benchmarks.bench_refresh <config.json> [rounds]`` from the
+project root. The tables of the configured database are dropped and
+recreated, so point it at a scratch database.
+"""
+import asyncio
+import sys
+import time
+
+from httpx import AsyncClient
+
+from app import init_app
+from app.services.database import sessionmanager
+
+
+async def main(config_file: str, rounds: int):
+    app = init_app(config_file)
+    async with sessionmanager.connect() as connection:
+        await sessionmanager.drop_all(connection)
+        await sessionmanager.create_all(connection)
+
+    credentials = {"username": "bench", "password": "test!wer1"}
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.post('/api/users/', json={
+            'username': 'bench', 'email': 'bench@example.com', 'full_name': 'Benchmark User'})
+        user_id = response.json()['id']
+        await client.post(f'/api/auth/users/{user_id}/set_auth', json={"password": credentials["password"]})
+        await client.put(f'/api/users/activate/{user_id}')
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            response = await client.post('/api/auth/token', data=credentials)
+            assert response.status_code == 200
+        login_rate = rounds / (time.perf_counter() - start)
+
+        refresh_token = response.json()['refresh_token']
+        start = time.perf_counter()
+        for _ in range(rounds):
+            response = await client.post('/api/auth/refresh', json={'refresh_token': refresh_token})
+            assert response.status_code == 200
+            refresh_token = response.json()['refresh_token']
+        refresh_rate = rounds / (time.perf_counter() - start)
+
+    await sessionmanager.close()
+
+    print(f"password login : {login_rate:10.1f} tokens/s")
+    print(f"refresh grant  : {refresh_rate:10.1f} tokens/s")
+    print(f"speedup        : {refresh_rate / login_rate:10.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 20))
@@ -0,0 +1,71 @@
+"""p50 / p99 latency and SQL statements per request for the write endpoints.
+
+Run with ``python -m benchmarks.bench_write_latency <config.json> [requests]``
+from the project root. The tables of the configured database are dropped and
+recreated, so point it at a scratch database. set_auth is left out because
+its latency is dominated by bcrypt.
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+from httpx import AsyncClient
+from sqlalchemy import event
+
+from app import init_app
+from app.services.database import sessionmanager
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def measure(name, count, request):
+    statements = 0
+
+    def before_cursor_execute(*args):
+        nonlocal statements
+        statements += 1
+
+    engine = sessionmanager._engine.sync_engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    samples = []
+    try:
+        for index in range(count):
+            start = time.perf_counter()
+            response = await request(index)
+            samples.append((time.perf_counter() - start) * 1000)
+            assert response.status_code < 300, response.text
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    print(f"{name:26} p50 {statistics.median(samples):7.2f} ms   "
+          f"p99 {percentile(samples, 0.99):7.2f} ms   {statements / count:4.1f} statements")
+
+
+async def main(config_file: str, count: int):
+    app = init_app(config_file)
+    async with sessionmanager.connect() as connection:
+        await sessionmanager.drop_all(connection)
+        await sessionmanager.create_all(connection)
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        await measure("POST /api/users/", count, lambda index: client.post('/api/users/', json={
+            'username': f'user{index}', 'email': f'user{index}@example.com', 'full_name': 'Benchmark User'}))
+        await measure("PUT /api/users/{id}", count, lambda index: client.put(
+            f'/api/users/{index + 1}', json={'full_name': f'Benchmark User {index}'}))
+        await measure("PUT /api/users/activate", count, lambda index: client.put(
+            f'/api/users/activate/{index + 1}'))
+        await measure("PUT /api/users/deactivate", count, lambda index: client.put(
+            f'/api/users/deactivate/{index + 1}'))
+        await measure("POST /api/roles/", count, lambda index: client.post('/api/roles/', json={
+            'name': f'role{index}', 'description': 'Benchmark role'}))
+        await measure("PUT /api/roles/{id}", count, lambda index: client.put(
+            f'/api/roles/{index + 1}', json={'description': f'Benchmark role {index}'}))
+
+    await sessionmanager.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 500))
@@ -0,0 +1,58 @@
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.config import config_manager, get_config
+from app.services.database import Base
+# Import the models so that their tables are registered on Base.metadata
+import app.sqlalchemy_models.user  # noqa: F401
+import app.sqlalchemy_models.token  # noqa: F401
+import app.sqlalchemy_models.login  # noqa: F401
+
+alembic_config = context.config
+if alembic_config.config_file_name is not None:
+    fileConfig(alembic_config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def database_url() -> str:
+    config_file = context.get_x_argument(as_dictionary=True).get("config", "config.json")
+    config_manager.init(config_file)
+    return get_config()["db_url"]
+
+
+def configure(**kwargs):
+    # One transaction per migration, so that a migration can step out of it
+    # with op.get_context().autocommit_block() for CREATE INDEX CONCURRENTLY
+    # and batched backfills without holding everything else open.
+    context.configure(target_metadata=target_metadata, transaction_per_migration=True,
+                      compare_type=True, **kwargs)
+
+
+def run_migrations_offline() -> None:
+    configure(url=database_url(), literal_binds=True, dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection: Connection) -> None:
+    configure(connection=connection)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_migrations_online() -> None:
+    engine = create_async_engine(database_url())
+    async with engine.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_migrations_online())
@@ -0,0 +1,62 @@
+"""Building blocks for migrations that run against live tables.
+
+On PostgreSQL indexes are built with CREATE INDEX CONCURRENTLY and large
+updates run in committed batches, so that neither holds locks that block
+the application for the length of the migration. Other databases (SQLite
+in tests) get the plain equivalents.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+
+def is_postgresql() -> bool:
+    return op.get_bind().dialect.name == "postgresql"
+
+
+def create_index_concurrently(name: str, table: str, columns: list, unique: bool = False, **kwargs) -> None:
+    """CREATE INDEX CONCURRENTLY outside the migration's transaction.
+
+    A failed concurrent build leaves an INVALID index behind. It is dropped
+    first so that a failed migration can simply be run again.
+    """
+    if not is_postgresql():
+        op.create_index(name, table, columns, unique=unique, **kwargs)
+        return
+
+    with op.get_context().autocommit_block():
+        if not op.get_context().as_sql:
+            valid = op.get_bind().execute(sa.text(
+                "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}).scalar()
+            if valid is False:
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+        op.create_index(name, table, columns, unique=unique, if_not_exists=True,
+                        postgresql_concurrently=True, **kwargs)
+
+
+def drop_index_concurrently(name: str, table: str) -> None:
+    if not is_postgresql():
+        op.drop_index(name, table_name=table)
+        return
+
+    with op.get_context().autocommit_block():
+        op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
+
+
+def batched_update(table: str, set_clause: str, where_clause: str, batch_size: int = 5000) -> None:
+    """UPDATE table SET set_clause for rows matching where_clause, batch_size
+    rows at a time, committing after every batch.
+
+    where_clause must stop matching a row once it is updated (for example
+    "new_column IS NULL"), otherwise the loop does not end.
+    """
+    if op.get_context().as_sql:
+        # Offline (--sql) scripts cannot loop on row counts
+        op.execute(f"UPDATE {table} SET {set_clause} WHERE {where_clause}")
+        return
+
+    statement = sa.text(
+        f"UPDATE {table} SET {set_clause} WHERE id IN "
+        f"(SELECT id FROM {table} WHERE {where_clause} LIMIT :batch_size)")
+    with op.get_context().autocommit_block():
+        while op.get_bind().execute(statement, {"batch_size": batch_size}).rowcount:
+            pass
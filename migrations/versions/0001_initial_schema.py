@@ -0,0 +1,65 @@
+"""Initial schema: users, roles and user_role_association
+
+Matches the tables that DatabaseSessionManager.create_all created before
+migrations were introduced. Databases created that way are brought under
+migration control with ``alembic stamp 0001``.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy_utc import UtcDateTime, utcnow
+
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def timestamps(updated_at: str = "updated_at") -> list[sa.Column]:
+    return [
+        sa.Column("created_at", UtcDateTime(timezone=True), nullable=False, server_default=utcnow()),
+        sa.Column(updated_at, UtcDateTime(timezone=True), nullable=False, server_default=utcnow()),
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        *timestamps(),
+        sa.Column("uuid", sa.String(), nullable=True, unique=True),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("full_name", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False, unique=True),
+        sa.Column("password", sa.String(), nullable=True),
+        sa.Column("disabled", sa.Boolean(), nullable=False),
+    )
+    op.create_table(
+        "roles",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        *timestamps(),
+        sa.Column("uuid", sa.String(), nullable=True, unique=True),
+        sa.Column("name", sa.String(), nullable=False, unique=True),
+        sa.Column("description", sa.String(), nullable=True),
+        sa.Column("disabled", sa.Boolean(), nullable=True),
+    )
+    op.create_table(
+        "user_role_association",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=True),
+        sa.Column("role_id", sa.Integer(), sa.ForeignKey("roles.id"), nullable=True),
+        *timestamps("udpated_at"),
+        sa.UniqueConstraint("user_id", "role_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("user_role_association")
+    op.drop_table("roles")
+    op.drop_table("users")
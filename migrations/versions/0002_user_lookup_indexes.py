@@ -0,0 +1,34 @@
+"""Indexes for username, lower(email) and role_id lookups
+
+The unique indexes fail on existing duplicates. Find them first with
+  SELECT username, count(*) FROM users GROUP BY username HAVING count(*) > 1;
+  SELECT lower(email), count(*) FROM users GROUP BY lower(email) HAVING count(*) > 1;
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import create_index_concurrently, drop_index_concurrently
+
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    create_index_concurrently("ix_users_username", "users", ["username"], unique=True)
+    create_index_concurrently("ix_users_email_lower", "users", [sa.text("lower(email)")], unique=True)
+    create_index_concurrently("ix_user_role_association_role_id", "user_role_association", ["role_id"])
+
+
+def downgrade() -> None:
+    drop_index_concurrently("ix_user_role_association_role_id", "user_role_association")
+    drop_index_concurrently("ix_users_email_lower", "users")
+    drop_index_concurrently("ix_users_username", "users")
@@ -0,0 +1,68 @@
+"""Store users.uuid and roles.uuid as native uuids
+
+On PostgreSQL the text column is replaced by a uuid column that is
+backfilled in batches and indexed concurrently, instead of an ALTER COLUMN
+... TYPE that rewrites the table under an exclusive lock. The swap at the
+end locks the table, copies rows written during the backfill and renames
+the column in one short transaction, so that no row inserted in between
+loses its uuid. Other databases store sa.Uuid as 32 hex characters, so
+the dashes are stripped in place.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 10:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import create_index_concurrently, batched_update, is_postgresql
+
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("users", "roles")
+
+
+def alter_uuid_type(table: str, existing_type, type_) -> None:
+    with op.batch_alter_table(table) as batch_op:
+        batch_op.alter_column("uuid", existing_type=existing_type, type_=type_)
+    if table == "users":
+        # The batch copy of the table cannot reflect expression indexes
+        op.create_index("ix_users_email_lower", "users", [sa.text("lower(email)")],
+                        unique=True, if_not_exists=True)
+
+
+def upgrade() -> None:
+    if not is_postgresql():
+        for table in TABLES:
+            op.execute(f"UPDATE {table} SET uuid = replace(uuid, '-', '')")
+            alter_uuid_type(table, sa.String(), sa.Uuid())
+        return
+
+    for table in TABLES:
+        op.add_column(table, sa.Column("uuid_native", sa.Uuid(), nullable=True))
+        batched_update(table, "uuid_native = uuid::uuid", "uuid_native IS NULL AND uuid IS NOT NULL")
+        create_index_concurrently(f"{table}_uuid_native_key", table, ["uuid_native"], unique=True)
+        op.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+        op.execute(f"UPDATE {table} SET uuid_native = uuid::uuid WHERE uuid_native IS NULL AND uuid IS NOT NULL")
+        op.drop_column(table, "uuid")
+        op.alter_column(table, "uuid_native", new_column_name="uuid")
+        op.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_uuid_key UNIQUE USING INDEX {table}_uuid_native_key")
+
+
+def downgrade() -> None:
+    if not is_postgresql():
+        for table in TABLES:
+            alter_uuid_type(table, sa.Uuid(), sa.String())
+            op.execute(f"UPDATE {table} SET uuid = substr(uuid, 1, 8) || '-' || substr(uuid, 9, 4) || '-' || "
+                       f"substr(uuid, 13, 4) || '-' || substr(uuid, 17, 4) || '-' || substr(uuid, 21)")
+        return
+
+    for table in TABLES:
+        op.alter_column(table, "uuid", existing_type=sa.Uuid(), type_=sa.String(),
+                        postgresql_using="uuid::text")
@@ -0,0 +1,36 @@
+"""Revoked access tokens
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy_utc import UtcDateTime, utcnow
+
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "revoked_tokens",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("created_at", UtcDateTime(timezone=True), nullable=False, server_default=utcnow()),
+        sa.Column("updated_at", UtcDateTime(timezone=True), nullable=False, server_default=utcnow()),
+        sa.Column("jti", sa.String(), nullable=True, unique=True),
+        sa.Column("user_id", sa.Integer(), nullable=True),
+        sa.Column("issued_before", UtcDateTime(timezone=True), nullable=True),
+        sa.Column("expires_at", UtcDateTime(timezone=True), nullable=False),
+    )
+    op.create_index("ix_revoked_tokens_expires_at", "revoked_tokens", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_revoked_tokens_expires_at", table_name="revoked_tokens")
+    op.drop_table("revoked_tokens")
@@ -0,0 +1,52 @@
+"""Drop the case sensitive unique constraint on users.email
+
+ix_users_email_lower (0002) is unique on lower(email), which is stricter,
+so the constraint from 0001 only adds a second index to maintain on every
+write.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from migrations.helpers import create_index_concurrently, is_postgresql
+
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# SQLite constraints from 0001 have no name, the batch copy names them with this
+NAMING_CONVENTION = {"uq": "uq_%(table_name)s_%(column_0_name)s"}
+
+
+def recreate_email_lower_index() -> None:
+    # The batch copy of the table cannot reflect expression indexes
+    op.create_index("ix_users_email_lower", "users", [sa.text("lower(email)")],
+                    unique=True, if_not_exists=True)
+
+
+def upgrade() -> None:
+    if is_postgresql():
+        op.drop_constraint("users_email_key", "users", type_="unique")
+        return
+
+    with op.batch_alter_table("users", naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_constraint("uq_users_email", type_="unique")
+    recreate_email_lower_index()
+
+
+def downgrade() -> None:
+    if is_postgresql():
+        create_index_concurrently("users_email_key", "users", ["email"], unique=True)
+        op.execute("ALTER TABLE users ADD CONSTRAINT users_email_key UNIQUE USING INDEX users_email_key")
+        return
+
+    with op.batch_alter_table("users", naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_unique_constraint("uq_users_email", ["email"])
+    recreate_email_lower_index()
@@ -0,0 +1,13 @@
+import pytest_asyncio
+
+from app.services.database import DatabaseSessionManager
+
+
+@pytest_asyncio.fixture
+async def tmp_manager(request, tmp_path):
+    """A session manager on a new SQLite file. Tests pass extra init()
+    arguments, such as pool, with indirect parametrization."""
+    manager = DatabaseSessionManager()
+    manager.init(f"sqlite+aiosqlite:///{tmp_path}/test.db", "testing", **getattr(request, "param", {}))
+    yield manager
+    await manager.close()
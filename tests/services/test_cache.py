@@ -0,0 +1,90 @@
+import time
+from uuid import uuid4
+
+from app.pydantic_models.user import CurrentUser
+from app.services.cache import TTLCache, PrincipalCache, RoleCache, TokenCache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(max_size=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(max_size=2, ttl_seconds=60)
+    cache.set("a", 1, ttl_seconds=0.01)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_disabled_ttl_cache_stores_nothing():
+    cache = TTLCache(max_size=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_principal_cache_invalidates_by_user_id():
+    cache = PrincipalCache()
+    user = CurrentUser(id=7, uuid=uuid4(), username="testuser7",
+                       email="testuser7@example.com", full_name="Seventh Test User", disabled=False)
+    cache.put(user, cache.get("testuser7")[1])
+    assert cache.get("testuser7")[0] == user
+    cache.invalidate(7)
+    assert cache.get("testuser7")[0] is None
+
+
+def test_principal_cache_skips_loads_that_raced_an_invalidation():
+    cache = PrincipalCache()
+    user = CurrentUser(id=7, uuid=uuid4(), username="testuser7",
+                       email="testuser7@example.com", full_name="Seventh Test User", disabled=False)
+    cached, generation = cache.get("testuser7")
+    assert cached is None
+    # The user is disabled while it is being loaded from the database
+    cache.invalidate(7)
+    cache.put(user, generation)
+    assert cache.get("testuser7")[0] is None
+
+    # The next load is cached
+    _, generation = cache.get("testuser7")
+    cache.put(user, generation)
+    assert cache.get("testuser7")[0] == user
+
+
+def test_role_cache_skips_loads_that_raced_an_invalidation():
+    cache = RoleCache()
+    _, generation = cache.get(7)
+    # A role is revoked while the role names are being loaded
+    cache.invalidate(7)
+    cache.put(7, frozenset({"admin"}), generation)
+    assert cache.get(7)[0] is None
+
+    _, generation = cache.get(7)
+    # Renaming or deleting any role clears the whole cache
+    cache.clear()
+    cache.put(7, frozenset({"admin"}), generation)
+    assert cache.get(7)[0] is None
+
+    _, generation = cache.get(7)
+    cache.put(7, frozenset(), generation)
+    assert cache.get(7)[0] == frozenset()
+
+
+def test_token_cache_entries_do_not_outlive_exp():
+    cache = TokenCache()
+    cache.configure(max_size=8, ttl_seconds=300)
+    cache.put("valid", {"sub": "testuser1", "exp": time.time() + 60})
+    cache.put("expired", {"sub": "testuser1", "exp": time.time() - 1})
+    cache.put("no_exp", {"sub": "testuser1"})
+    assert cache.get("valid", "/api/auth/me")["sub"] == "testuser1"
+    assert cache.get("expired", "/api/auth/me") is None
+    assert cache.get("no_exp") is None
+    assert cache.stats()["routes"]["/api/auth/me"] == {"hits": 1, "misses": 1}
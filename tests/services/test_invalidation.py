@@ -0,0 +1,149 @@
+import asyncio
+import json
+from uuid import uuid4
+
+import pytest
+
+from app.pydantic_models.user import CurrentUser
+from app.services.cache import PrincipalCache, RoleCache
+from app.services.invalidation import InvalidationBus, PostgresBackend, USER, ROLES, RESET
+
+
+def worker(broker: str) -> tuple[InvalidationBus, PrincipalCache, RoleCache]:
+    bus = InvalidationBus()
+    bus.configure(broker=broker)
+    principals, roles = PrincipalCache(), RoleCache()
+    bus.subscribe(USER, principals.invalidate)
+    bus.subscribe(USER, roles.invalidate)
+    bus.subscribe(ROLES, lambda _: roles.clear())
+    bus.subscribe(RESET, lambda _: principals.clear())
+    return bus, principals, roles
+
+
+def principal(id: int) -> CurrentUser:
+    return CurrentUser(id=id, uuid=uuid4(), username=f"testuser{id}",
+                       email=f"testuser{id}@example.com", full_name="Test User", disabled=False)
+
+
+def cache_principal(principals: PrincipalCache, id: int):
+    # A miss followed by a load, as in get_current_user
+    _, generation = principals.get(f"testuser{id}")
+    principals.put(principal(id), generation)
+
+
+@pytest.mark.asyncio
+async def test_invalidations_reach_every_worker():
+    (bus_a, principals_a, roles_a), (bus_b, principals_b, roles_b) = worker("workers"), worker("workers")
+    try:
+        for principals, roles in ((principals_a, roles_a), (principals_b, roles_b)):
+            cache_principal(principals, 1)
+            cache_principal(principals, 2)
+            roles.put(1, frozenset({"admin"}), roles.get(1)[1])
+
+        bus_a.publish(USER, 1)
+        for principals, roles in ((principals_a, roles_a), (principals_b, roles_b)):
+            assert principals.get("testuser1")[0] is None
+            assert principals.get("testuser2")[0] is not None
+            assert roles.get(1)[0] is None
+
+        roles_a.put(2, frozenset({"admin"}), roles_a.get(2)[1])
+        roles_b.put(2, frozenset({"admin"}), roles_b.get(2)[1])
+        bus_b.publish(ROLES)
+        assert roles_a.get(2)[0] is None and roles_b.get(2)[0] is None
+
+        # A worker applies its own messages once, when publishing
+        assert bus_a.stats()["published"] == 1 and bus_a.stats()["received"] == 1
+        assert bus_b.stats()["published"] == 1 and bus_b.stats()["received"] == 1
+    finally:
+        await bus_a.stop()
+        await bus_b.stop()
+
+
+@pytest.mark.asyncio
+async def test_workers_on_other_brokers_are_not_reached():
+    (bus_a, _, _), (bus_b, principals_b, _) = worker("one"), worker("other")
+    try:
+        cache_principal(principals_b, 1)
+        bus_a.publish(USER, 1)
+        assert principals_b.get("testuser1")[0] is not None
+    finally:
+        await bus_a.stop()
+        await bus_b.stop()
+
+
+def test_postgres_backend_notifications_are_dispatched():
+    bus, principals, _ = worker("postgres")
+    backend = PostgresBackend(bus, "postgresql+asyncpg://user:secret@db/app")
+    assert backend._dsn == "postgresql://user:secret@db/app"
+
+    cache_principal(principals, 1)
+    backend._notified(None, 1, "cache_invalidation", json.dumps({"origin": bus.origin, "kind": USER, "key": 1}))
+    assert principals.get("testuser1")[0] is not None
+    backend._notified(None, 1, "cache_invalidation", json.dumps({"origin": "other", "kind": USER, "key": 1}))
+    assert principals.get("testuser1")[0] is None
+
+    cache_principal(principals, 2)
+    bus.receive_reset()
+    assert principals.get("testuser2")[0] is None
+
+
+class FailingConnection:
+    def __init__(self):
+        self.closed = False
+
+    async def execute(self, *args):
+        raise OSError("connection reset")
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self, timeout=None):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_postgres_backend_closes_failed_connections():
+    bus, _, _ = worker("postgres_failures")
+    backend = PostgresBackend(bus, "postgresql+asyncpg://user:secret@db/app", retry_seconds=0.01)
+    connections = []
+
+    async def connect():
+        connections.append(FailingConnection())
+        backend._connection = connections[-1]
+
+    backend._connect = connect
+    await backend.start()
+    backend.send("payload")
+    while len(connections) < 2:
+        await asyncio.sleep(0.01)
+    task = backend._task
+    await backend.stop()
+
+    assert task.done() and backend._task is None
+    assert all(connection.closed for connection in connections)
+    assert backend.stats()["connected"] is False
+
+
+def test_postgres_backend_replaces_overflow_with_reset():
+    sender, _, _ = worker("postgres_overflow")
+    backend = PostgresBackend(sender, "postgresql+asyncpg://user:secret@db/app", max_queued=3)
+    for user_id in range(5):
+        backend.send(sender.payload(USER, user_id))
+    # The fourth message overflowed the queue, the fifth fits behind the reset
+    assert backend.stats()["queued"] == 2 and backend.stats()["dropped"] == 4
+    reset = backend._queue.get_nowait()
+    assert json.loads(backend._queue.get_nowait())["key"] == 4
+
+    # Another worker clears its caches on the reset
+    receiver, principals, _ = worker("postgres_overflow_receiver")
+    cache_principal(principals, 1)
+    receiver.receive(reset)
+    assert principals.get("testuser1")[0] is None
+
+
+def test_configuration_errors():
+    bus = InvalidationBus()
+    with pytest.raises(ValueError):
+        bus.configure(backend="redis")
+    with pytest.raises(ValueError):
+        bus.configure("sqlite+aiosqlite:///:memory:", backend="postgres")
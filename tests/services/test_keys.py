@@ -0,0 +1,88 @@
+import json
+import os
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+from app.services.keys import KeyRing
+
+
+def write_key(path, private_key, public_only=False):
+    if public_only:
+        data = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    else:
+        data = private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    path.write_bytes(data)
+
+
+def write_keyset(path, signing_kid, keys, mtime):
+    path.write_text(json.dumps({"signing_kid": signing_kid, "keys": keys}))
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def keys(tmp_path):
+    ed_key = ed25519.Ed25519PrivateKey.generate()
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    write_key(tmp_path / "new.pem", ed_key)
+    write_key(tmp_path / "old.pem", rsa_key)
+    write_key(tmp_path / "old.pub.pem", rsa_key, public_only=True)
+    return tmp_path
+
+
+def test_secret_key_signs_without_kid():
+    keyring = KeyRing()
+    keyring.configure("test_secret_key")
+    token = keyring.sign({"sub": "testuser1"})
+    assert "kid" not in jwt.get_unverified_header(token)
+    assert jwt.decode(token, "test_secret_key", algorithms=["HS256"]) == {"sub": "testuser1"}
+    assert keyring.decode(token) == {"sub": "testuser1"}
+    assert keyring.jwks() == {"keys": []}
+
+
+def test_rotation_through_the_keys_file(keys):
+    keyset = keys / "keys.json"
+    write_keyset(keyset, "old", [{"kid": "old", "algorithm": "RS256", "private_key_file": "old.pem"}], 1000)
+    keyring = KeyRing()
+    keyring.configure("test_secret_key", file=str(keyset), reload_seconds=0)
+    old_token = keyring.sign({"sub": "testuser1"})
+    assert jwt.get_unverified_header(old_token) == {"alg": "RS256", "kid": "old", "typ": "JWT"}
+    legacy_token = jwt.encode({"sub": "testuser1"}, "test_secret_key", algorithm="HS256")
+
+    # Sign with a new key, keep verifying with the public half of the old one
+    write_keyset(keyset, "new", [{"kid": "new", "algorithm": "EdDSA", "private_key_file": "new.pem"},
+                                 {"kid": "old", "algorithm": "RS256", "public_key_file": "old.pub.pem"}], 2000)
+    new_token = keyring.sign({"sub": "testuser1"})
+    assert jwt.get_unverified_header(new_token)["kid"] == "new"
+    for token in (old_token, new_token, legacy_token):
+        assert keyring.decode(token) == {"sub": "testuser1"}
+    assert [(key["kid"], key["alg"]) for key in keyring.jwks()["keys"]] == [("new", "EdDSA"), ("old", "RS256")]
+    assert all("d" not in key for key in keyring.jwks()["keys"])
+
+    # A broken file keeps the keys in use
+    keyset.write_text("{")
+    os.utime(keyset, (3000, 3000))
+    assert keyring.decode(new_token) == {"sub": "testuser1"}
+
+
+def test_tokens_cannot_choose_their_key_or_algorithm(keys):
+    keyset = keys / "keys.json"
+    write_keyset(keyset, "new", [{"kid": "new", "algorithm": "EdDSA", "private_key_file": "new.pem"}], 1000)
+    keyring = KeyRing()
+    keyring.configure(file=str(keyset))
+    with pytest.raises(jwt.InvalidTokenError):
+        keyring.decode(jwt.encode({"sub": "testuser1"}, "guess", algorithm="HS256", headers={"kid": "other"}))
+    with pytest.raises(jwt.InvalidTokenError):
+        # No secret_key configured, tokens without kid are not accepted
+        keyring.decode(jwt.encode({"sub": "testuser1"}, "guess", algorithm="HS256"))
+
+
+def test_signing_key_needs_a_private_key(keys):
+    keyset = keys / "keys.json"
+    write_keyset(keyset, "old", [{"kid": "old", "algorithm": "RS256", "public_key_file": "old.pub.pem"}], 1000)
+    with pytest.raises(ValueError):
+        KeyRing().configure(file=str(keyset))
@@ -0,0 +1,65 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import text
+
+from app.services.metrics import (
+    MetricsRegistry, RequestTimings, instrument_engine, observe_password_hashing, request_timings)
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    registry.configure(buckets=[0.1, 1])
+    timings = RequestTimings()
+    timings.sql_count, timings.sql_seconds, timings.hash_seconds = 2, 0.01, 0.2
+    registry.observe("GET", "/api/users/{id}", 200, 0.05, timings)
+    registry.observe("GET", "/api/users/{id}", 200, 0.5, timings)
+    registry.observe("GET", "/api/users/{id}", 200, 5, RequestTimings())
+
+    lines = registry.render().splitlines()
+    labels = 'method="GET",route="/api/users/{id}",status="200"'
+    assert "# TYPE http_request_duration_seconds histogram" in lines
+    assert f'http_request_duration_seconds_bucket{{{labels},le="0.1"}} 1' in lines
+    assert f'http_request_duration_seconds_bucket{{{labels},le="1"}} 2' in lines
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in lines
+    assert f"http_request_duration_seconds_count{{{labels}}} 3" in lines
+    assert f"http_request_sql_statements_total{{{labels}}} 4" in lines
+    assert f"http_request_password_hashing_seconds_total{{{labels}}} 0.4" in lines
+
+
+@pytest.mark.asyncio
+async def test_engine_events_count_against_current_request(tmp_manager):
+    instrument_engine(tmp_manager.engines()[0])
+    # Instrumenting twice does not count twice
+    instrument_engine(tmp_manager.engines()[0])
+    async with tmp_manager.session() as session:
+        # Outside of a request nothing is recorded
+        await session.execute(text("SELECT 1"))
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        try:
+            await session.execute(text("SELECT 1"))
+            await session.execute(text("SELECT 2"))
+            observe_password_hashing(0.25)
+        finally:
+            request_timings.reset(token)
+    assert timings.sql_count == 2
+    assert timings.sql_seconds > 0
+    assert timings.hash_seconds == 0.25
+
+
+@pytest.mark.asyncio
+async def test_server_timing_and_metrics(app):
+    # A missing user, so that the test does not depend on the data of others
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.get('/api/users/999')
+        assert response.status_code == 400
+        timing = response.headers['server-timing']
+        assert timing.startswith('app;dur=')
+        assert 'desc="1 queries"' in timing
+        assert 'hash;dur=0.0' in timing
+
+        response = await client.get('/api/stats/metrics')
+    assert response.status_code == 200
+    labels = 'method="GET",route="/api/users/{id}",status="400"'
+    assert f'http_request_duration_seconds_count{{{labels}}}' in response.text
+    assert f'http_request_sql_statements_total{{{labels}}}' in response.text
@@ -0,0 +1,32 @@
+import asyncio
+import pytest
+
+from app.services.password import PasswordHasher, PasswordHasherBusy
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_on_worker_pool():
+    hasher = PasswordHasher()
+    hasher.init(executor="thread", max_workers=1, max_queue=4)
+    try:
+        hashed = await hasher.hash("test!wer1")
+        assert await hasher.verify("test!wer1", hashed)
+        assert not await hasher.verify("wrong", hashed)
+        assert hasher.stats()["completed"] == 3
+    finally:
+        hasher.close()
+
+
+@pytest.mark.asyncio
+async def test_rejects_when_queue_is_full():
+    hasher = PasswordHasher()
+    hasher.init(executor="thread", max_workers=1, max_queue=1)
+    try:
+        first = asyncio.ensure_future(hasher.hash("test!wer1"))
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.hash("test!wer2")
+        await first
+        assert hasher.stats()["rejected"] == 1
+    finally:
+        hasher.close()
@@ -0,0 +1,88 @@
+import pytest
+from sqlalchemy import text
+
+from app.services.ratelimit import LoginLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def attempts(limiter, ip, username, count):
+    return [await limiter.check(ip, username) for _ in range(count)]
+
+
+async def check_buckets(limiter, clock):
+    # Two attempts per username, refilled at one per second
+    assert await attempts(limiter, "10.0.0.1", "testuser1", 3) == [0, 0, 1.0]
+    # Usernames are limited regardless of case and of the client's IP
+    assert await limiter.check("10.0.0.2", "TestUser1") == 1.0
+    assert await limiter.check("10.0.0.2", "testuser2") == 0
+
+    clock.now += 1
+    assert await attempts(limiter, "10.0.0.1", "testuser1", 2) == [0, 1.0]
+
+    # Five attempts per IP. Once the IP is over its limit the usernames it
+    # tries are not charged.
+    assert await attempts(limiter, "10.0.0.3", "testuser3", 2) == [0, 0]
+    waits = [await limiter.check("10.0.0.3", f"guess{index}") for index in range(4)]
+    assert [wait > 0 for wait in waits] == [False, False, False, True]
+    assert await attempts(limiter, "10.0.0.4", "guess3", 2) == [0, 0]
+
+    assert limiter.stats() == {"allowed": 11, "rejected_ip": 1, "rejected_username": 3}
+
+
+@pytest.mark.asyncio
+async def test_memory_buckets():
+    clock = Clock()
+    limiter = LoginLimiter(clock)
+    limiter.configure(ip_capacity=5, ip_refill_per_second=0.1,
+                      username_capacity=2, username_refill_per_second=1)
+    await check_buckets(limiter, clock)
+
+
+@pytest.mark.asyncio
+async def test_database_buckets(tmp_manager):
+    async with tmp_manager.connect() as connection:
+        await tmp_manager.create_all(connection)
+    clock = Clock()
+    limiter = LoginLimiter(clock)
+    limiter.configure("database", ip_capacity=5, ip_refill_per_second=0.1,
+                      username_capacity=2, username_refill_per_second=1, session=tmp_manager.session)
+    await check_buckets(limiter, clock)
+
+    # Buckets that have refilled are deleted
+    clock.now += 3600
+    await limiter.check("10.0.0.9", "testuser9")
+    async with tmp_manager.session() as session:
+        keys = (await session.execute(text("SELECT key FROM login_buckets"))).scalars().all()
+    assert sorted(keys) == ["ip:10.0.0.9", "username:testuser9"]
+
+
+@pytest.mark.asyncio
+async def test_ip_bucket_can_be_turned_off():
+    limiter = LoginLimiter(Clock())
+    limiter.configure(ip_capacity=None, username_capacity=2, username_refill_per_second=1)
+    waits = [await limiter.check("10.0.0.1", f"guess{index}") for index in range(10)]
+    assert waits == [0] * 10
+    assert await attempts(limiter, "10.0.0.1", "testuser1", 3) == [0, 0, 1.0]
+
+
+def test_client_ip_behind_trusted_proxies():
+    limiter = LoginLimiter()
+    # Without trusted proxies the forwarded header is ignored
+    assert limiter.client_ip("10.0.0.5", "203.0.113.7") == "10.0.0.5"
+
+    limiter.configure(trusted_proxies=["10.0.0.0/8", "192.0.2.1"])
+    assert limiter.client_ip("10.0.0.5", "203.0.113.7") == "203.0.113.7"
+    # Addresses left of the first untrusted one may be forged by the client
+    assert limiter.client_ip("10.0.0.5", "198.51.100.1, 203.0.113.7, 192.0.2.1") == "203.0.113.7"
+    assert limiter.client_ip("10.0.0.5", "10.1.1.1, 192.0.2.1") == "10.1.1.1"
+    assert limiter.client_ip("10.0.0.5", None) == "10.0.0.5"
+    # Only a trusted peer may set the header
+    assert limiter.client_ip("203.0.113.9", "198.51.100.1") == "203.0.113.9"
+    assert limiter.client_ip(None, "198.51.100.1") is None
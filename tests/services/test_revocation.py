@@ -0,0 +1,49 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from app.services import revocation
+from app.services.revocation import RevocationList, reload_revocations
+
+
+def test_revoked_token_ids_expire_with_the_token():
+    revocations = RevocationList()
+    now = time.time()
+    revocations.revoke_token("revoked", now + 60)
+    revocations.revoke_token("expired", now - 1)
+    assert revocations.is_revoked({"jti": "revoked", "iat": now})
+    assert not revocations.is_revoked({"jti": "expired", "iat": now})
+    assert not revocations.is_revoked({"jti": "other", "iat": now})
+    assert revocations.stats() == {"tokens": 1, "users": 0}
+
+
+def test_user_revocations_cover_tokens_issued_before_them():
+    revocations = RevocationList()
+    now = time.time()
+    revocations.revoke_user(7, now, now + 60)
+    assert revocations.is_revoked({"jti": "a", "iat": now - 0.5}, 7)
+    assert not revocations.is_revoked({"jti": "b", "iat": now + 0.5}, 7)
+    assert not revocations.is_revoked({"jti": "c", "iat": now - 0.5}, 8)
+    # Tokens from before iat was issued count as old
+    assert revocations.is_revoked({"sub": "testuser7"}, 7)
+
+    # An older cutoff does not replace a newer one
+    revocations.revoke_user(7, now - 10, now + 60)
+    assert revocations.is_revoked({"iat": now - 0.5}, 7)
+
+
+@pytest.mark.asyncio
+async def test_failed_reloads_are_logged(monkeypatch, caplog):
+    async def failing_load():
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(revocation, "load_revocations", failing_load)
+    with caplog.at_level(logging.ERROR, logger="app.services.revocation"):
+        reload_revocations()
+        assert len(revocation._reload_tasks) == 1
+        await asyncio.gather(*revocation._reload_tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+    assert not revocation._reload_tasks
+    assert "Could not reload the revoked tokens" in caplog.text
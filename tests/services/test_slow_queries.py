@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import pytest
+from sqlalchemy import text
+
+from app.services.metrics import RequestTimings, request_timings
+from app.services.slow_queries import SlowQueryLog, redact
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_redact_keeps_only_types():
+    assert redact({"value": "secret", "limit": 1}) == {"value": "str", "limit": "int"}
+    assert redact(("secret", None)) == ["str", "NoneType"]
+    assert redact([("a",), ("b",)], executemany=True) == "<2 parameter sets>"
+
+
+@pytest.mark.asyncio
+async def test_slow_queries_are_logged_rate_limited_and_explained(tmp_manager, caplog):
+    clock = Clock()
+    log = SlowQueryLog(clock)
+    # Every statement is slow
+    log.configure(threshold_seconds=0, max_per_minute=2, explain=True)
+    log.watch(tmp_manager.engines()[0])
+    caplog.set_level(logging.WARNING, logger="app.services.slow_queries")
+    try:
+        async with tmp_manager.session() as session:
+            token = request_timings.set(RequestTimings({"method": "GET", "path": "/api/users/1"}))
+            try:
+                await session.execute(text("SELECT :value AS secret"), {"value": "hunter2"})
+            finally:
+                request_timings.reset(token)
+            await session.execute(text("SELECT 2"))
+            await session.execute(text("SELECT 3"))
+            await asyncio.gather(*log._tasks)
+
+            messages = [record.getMessage() for record in caplog.records]
+            assert "hunter2" not in "\n".join(messages)
+            assert messages[0].startswith("Slow query ")
+            assert "(GET /api/users/1): SELECT ? AS secret parameters ['str']" in messages[0]
+            assert "(outside a request): SELECT 2" in messages[1]
+            # Only the first SELECT within explain_interval_seconds is explained
+            assert messages[2].startswith("Plan of slow query (GET /api/users/1): EXPLAIN QUERY PLAN SELECT ?")
+            assert len(messages) == 3
+            assert log.stats() == {"threshold_seconds": 0, "logged": 2, "suppressed": 1, "explained": 1}
+
+            clock.now += 60
+            caplog.clear()
+            await session.execute(text("SELECT 4"))
+            messages = [record.getMessage() for record in caplog.records]
+            assert messages[0] == "1 slow queries were not logged in the last minute"
+            assert "SELECT 4" in messages[1]
+    finally:
+        await log.close()
+
+
+@pytest.mark.asyncio
+async def test_left_out_count_is_logged_when_the_minute_ends(tmp_manager, caplog):
+    clock = Clock()
+    log = SlowQueryLog(clock)
+    log.configure(threshold_seconds=0, max_per_minute=1)
+    log.watch(tmp_manager.engines()[0])
+    caplog.set_level(logging.WARNING, logger="app.services.slow_queries")
+    try:
+        async with tmp_manager.session() as session:
+            await session.execute(text("SELECT 1"))
+            # The burst ends just before the minute does, no query follows it
+            clock.now += 59.95
+            await session.execute(text("SELECT 2"))
+            await session.execute(text("SELECT 3"))
+        caplog.clear()
+        await asyncio.sleep(0.2)
+        assert [record.getMessage() for record in caplog.records] == [
+            "2 slow queries were not logged in the last minute"]
+    finally:
+        await log.close()
+
+
+@pytest.mark.asyncio
+async def test_fast_queries_are_not_logged(tmp_manager, caplog):
+    log = SlowQueryLog()
+    log.configure(threshold_seconds=10)
+    log.watch(tmp_manager.engines()[0])
+    async with tmp_manager.session() as session:
+        await session.execute(text("SELECT 1"))
+    assert log.stats()["logged"] == 0
+    assert not caplog.records
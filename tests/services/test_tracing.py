@@ -0,0 +1,95 @@
+import pytest
+from httpx import AsyncClient
+
+from app.services.tracing import Tracer, trace_engine, tracer
+from app.sqlalchemy_models.user import Role, User
+
+
+def test_spans_nest_and_record_exceptions():
+    tracer = Tracer()
+    tracer.configure("memory")
+    with tracer.span("outer", kind="test") as outer:
+        leaf = tracer.start_span("leaf")
+        leaf.end()
+        with pytest.raises(ValueError):
+            with tracer.span("inner"):
+                raise ValueError("boom")
+    leaf, inner, outer = tracer.exporter.spans
+    assert outer.parent is None and outer.attributes == {"kind": "test"}
+    assert leaf.parent is outer and inner.parent is outer
+    assert isinstance(inner.exception, ValueError)
+    assert outer.duration >= inner.duration
+
+
+def test_noop_tracer_records_nothing():
+    tracer = Tracer()
+    with tracer.span("outer") as span:
+        span.set_attribute("rows", 1)
+    assert not tracer.enabled and tracer.exporter is None
+
+
+@pytest.mark.asyncio
+async def test_model_methods_sessions_and_statements(tmp_manager):
+    trace_engine(tmp_manager.engines()[0])
+    try:
+        async with tmp_manager.connect() as connection:
+            await tmp_manager.create_all(connection)
+        async with tmp_manager.session() as session:
+            role = await Role.create(session, "traced", "Traced role")
+            user = await User.create(session, "traced", "Traced User", "traced@example.com")
+            await User.add_role(session, user.id, role.id)
+
+        tracer.configure("memory")
+        async with tmp_manager.session() as session:
+            await Role.get(session, role.id, with_users=True)
+        spans = tracer.exporter.spans
+    finally:
+        tracer.configure()
+
+    get = next(span for span in spans if span.name == "Role.get")
+    load = next(span for span in spans if span.name == "load Role.users")
+    statements = [span for span in spans if span.name == "SQL SELECT"]
+    assert get.attributes["rows"] == 1
+    assert load.parent is get and load.attributes == {"relationship": "Role.users", "rows": 1}
+    assert [span.parent for span in statements] == [get, load]
+    assert statements[0].attributes["db.system"] == "sqlite"
+    assert spans[-1].name == "session" and spans[-1].duration > 0
+
+
+@pytest.mark.asyncio
+async def test_route_spans(app):
+    tracer.configure("memory")
+    try:
+        async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+            response = await client.get('/api/users/999')
+        spans = tracer.exporter.spans
+    finally:
+        tracer.configure()
+    assert response.status_code == 400
+
+    route = spans[-1]
+    assert route.name == "GET /api/users/{id}"
+    assert route.attributes["http.status_code"] == 400
+    names = {span.name: span for span in spans}
+    assert names["User.get"].parent is route
+    assert isinstance(names["User.get"].exception, ValueError)
+    assert names["read_session"].parent is route
+    assert names["read_session"].attributes["db.replica"] is False
+
+
+def test_opentelemetry_exporter():
+    sdk = pytest.importorskip("opentelemetry.sdk.trace")
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    exporter = InMemorySpanExporter()
+    provider = sdk.TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    tracer = Tracer()
+    tracer.configure("opentelemetry")
+    tracer._otel = provider.get_tracer("test")
+    with tracer.span("outer", kind="test"):
+        tracer.start_span("leaf").end()
+    leaf, outer = exporter.get_finished_spans()
+    assert leaf.parent.span_id == outer.context.span_id
+    assert outer.attributes["kind"] == "test"
@@ -1,5 +1,6 @@
 import pytest
 from httpx import AsyncClient
+from uuid import uuid4
 from ..utils import remove_uuid
 import jwt
 from app.config import get_config
@@ -248,10 +249,15 @@ async def test_get_user_by_uuid(app):
 
     # Test for non-existing user
     async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
-        response = await client.get('/api/users/uuid/nonexistinguuid')
+        response = await client.get('/api/users/uuid/' + str(uuid4()))
     assert response.status_code == 400
     assert response.json() == {'detail': 'User not found'}
 
+    # Test for a malformed uuid, rejected before it reaches the database
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.get('/api/users/uuid/nonexistinguuid')
+    assert response.status_code == 422
+
 
 @pytest.mark.asyncio
 async def test_get_role_for_user_with_no_roles(app):
@@ -355,3 +361,337 @@ async def test_user_login_for_inactive_user_again(app):
         })
     assert response.status_code == 401
     assert response.json() == {'detail': 'Inactive user'}
+
+
+@pytest.mark.asyncio
+async def test_deactivating_user_with_cached_token(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.put('/api/users/activate/1')
+        assert response.status_code == 200
+
+        response = await client.post('/api/auth/token', data={
+            "username": "testuser1",
+            "password": "test!wer1"
+        })
+        headers = {'Authorization': 'Bearer ' + response.json()['access_token']}
+
+        response = await client.get('/api/auth/me', headers=headers)
+        assert response.status_code == 200
+
+        response = await client.put('/api/users/deactivate/1')
+        assert response.status_code == 200
+
+        # Deactivating revokes the tokens issued so far
+        response = await client.get('/api/auth/me', headers=headers)
+    assert response.status_code == 401
+    assert response.json() == {'detail': 'Invalid authentication credentials'}
+
+
+@pytest.mark.asyncio
+async def test_revoked_tokens(app):
+    async def login(client):
+        response = await client.post('/api/auth/token', data={
+            "username": "testuser1",
+            "password": "test!wer1"
+        })
+        assert response.status_code == 200
+        return {'Authorization': 'Bearer ' + response.json()['access_token']}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.put('/api/users/activate/1')
+        assert response.status_code == 200
+        first, second = await login(client), await login(client)
+        assert first != second
+
+        # Logging out revokes only the token used for it
+        response = await client.post('/api/auth/logout', headers=first)
+        assert response.status_code == 204
+        response = await client.get('/api/auth/me', headers=first)
+        assert response.status_code == 401
+        response = await client.get('/api/auth/me', headers=second)
+        assert response.status_code == 200
+
+        # Setting a password revokes every earlier token, later logins work
+        response = await client.post('/api/auth/users/1/set_auth', json={"password": "test!wer1"})
+        assert response.status_code == 200
+        response = await client.get('/api/auth/me', headers=second)
+        assert response.status_code == 401
+        third = await login(client)
+        response = await client.get('/api/auth/me', headers=third)
+        assert response.status_code == 200
+
+        response = await client.put('/api/users/deactivate/1')
+        assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_revocation_is_not_committed_for_missing_user(app, db):
+    from sqlalchemy import func, select
+    from app.sqlalchemy_models.token import RevokedToken
+    from app.sqlalchemy_models.user import User
+
+    revocations = await db.scalar(select(func.count()).select_from(RevokedToken))
+    await db.commit()
+
+    with pytest.raises(ValueError, match="User not found"):
+        await User.deactivate(db, 999)
+    assert not db.in_transaction()
+    with pytest.raises(ValueError, match="User not found"):
+        await User.set_password(db, 999, "hash")
+    assert not db.in_transaction()
+
+    assert await db.scalar(select(func.count()).select_from(RevokedToken)) == revocations
+
+
+@pytest.mark.asyncio
+async def test_outdated_password_hash_is_upgraded_on_login(app, db):
+    from passlib.hash import bcrypt
+    from app.services.database import sessionmanager
+    from app.services.password import pwd_context
+    from app.sqlalchemy_models.user import User
+
+    credentials = {"username": "testuser1", "password": "test!wer1"}
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.put('/api/users/activate/1')
+        assert response.status_code == 200
+        response = await client.post('/api/auth/token', data=credentials)
+        headers = {'Authorization': 'Bearer ' + response.json()['access_token']}
+
+        outdated = bcrypt.using(rounds=4).hash(credentials["password"])
+        await User.set_password(db, 1, outdated, revoke_tokens=False)
+        settings = pwd_context.to_dict()
+        pwd_context.update(bcrypt__min_rounds=10)
+        try:
+            response = await client.post('/api/auth/token', data=credentials)
+            assert response.status_code == 200
+            async with sessionmanager.session() as session:
+                upgraded = (await User.get(session, 1)).password
+            assert upgraded != outdated
+            assert not pwd_context.needs_update(upgraded)
+            assert pwd_context.verify(credentials["password"], upgraded)
+        finally:
+            pwd_context.load(settings)
+
+        # The upgrade is not a password change, earlier tokens stay valid
+        response = await client.get('/api/auth/me', headers=headers)
+        assert response.status_code == 200
+
+        response = await client.put('/api/users/deactivate/1')
+        assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_get_users_paginated(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        # Without limit or after the whole list comes back, as before paging existed
+        response = await client.get('/api/users/')
+        assert [user['id'] for user in response.json()] == [1, 3]
+        assert 'X-Next-Cursor' not in response.headers
+
+        response = await client.get('/api/users/', params={'limit': 1})
+        assert response.status_code == 200
+        assert [user['id'] for user in response.json()] == [1]
+        next_cursor = response.headers['X-Next-Cursor']
+        assert next_cursor == '1'
+
+        response = await client.get('/api/users/', params={'limit': 1, 'after': next_cursor})
+        assert response.status_code == 200
+        assert [user['id'] for user in response.json()] == [3]
+        assert 'X-Next-Cursor' not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_get_users_filtered(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        # The underscore must match literally, not as a LIKE wildcard
+        response = await client.get('/api/users/', params={'username_prefix': 'testuser_'})
+        assert response.status_code == 200
+        assert [user['username'] for user in response.json()] == ['testuser_three']
+
+        response = await client.get('/api/users/', params={'disabled': False})
+        assert response.status_code == 200
+        assert response.json() == []
+
+
+@pytest.mark.asyncio
+async def test_create_user_duplicate_username(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.post('/api/users/', json={
+            'username': 'testuser1',
+            'email': 'another.testuser1@example.com',
+            'full_name': 'First Test User'
+        })
+    assert response.status_code == 400
+    assert response.json() == {'detail': 'User with that username already exists'}
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_email_ignores_case(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.get('/api/users/email/TestUser1@Example.com')
+    assert response.status_code == 200
+    assert response.json()['username'] == 'testuser1'
+
+
+@pytest.mark.asyncio
+async def test_refresh_tokens_rotate_and_detect_reuse(app, db):
+    from sqlalchemy import select
+    from app.sqlalchemy_models.token import RefreshToken
+
+    async def token_row(token):
+        db.expire_all()
+        return await db.scalar(select(RefreshToken).where(RefreshToken.token_hash == RefreshToken.digest(token)))
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.put('/api/users/activate/1')
+        assert response.status_code == 200
+        response = await client.post('/api/auth/token', data={
+            "username": "testuser1",
+            "password": "test!wer1"
+        })
+        first = response.json()['refresh_token']
+
+        response = await client.post('/api/auth/refresh', json={'refresh_token': first})
+        assert response.status_code == 200
+        second = response.json()['refresh_token']
+        assert second != first
+        # The family keeps the expiry of its login
+        expires_at = (await token_row(first)).expires_at
+        assert (await token_row(second)).expires_at == expires_at
+        headers = {'Authorization': 'Bearer ' + response.json()['access_token']}
+        response = await client.get('/api/auth/me', headers=headers)
+        assert response.status_code == 200
+        assert response.json()['username'] == 'testuser1'
+
+        # Using a rotated token again ends the family, the current token too
+        response = await client.post('/api/auth/refresh', json={'refresh_token': first})
+        assert response.status_code == 401
+        response = await client.post('/api/auth/refresh', json={'refresh_token': second})
+        assert response.status_code == 401
+        assert response.json() == {'detail': 'Invalid refresh token'}
+
+        # Deactivating a user revokes their refresh tokens
+        response = await client.post('/api/auth/token', data={
+            "username": "testuser1",
+            "password": "test!wer1"
+        })
+        third = response.json()['refresh_token']
+        response = await client.put('/api/users/deactivate/1')
+        assert response.status_code == 200
+        response = await client.post('/api/auth/refresh', json={'refresh_token': third})
+        assert response.status_code == 401
+
+        # An inactive user's token is refused without being used up
+        fourth = await RefreshToken.issue(db, 1, expires_at)
+        response = await client.post('/api/auth/refresh', json={'refresh_token': fourth})
+        assert response.status_code == 401
+        assert response.json() == {'detail': 'Inactive user'}
+        assert (await token_row(fourth)).used_at is None
+        await db.delete(await token_row(fourth))
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_deleting_user_deletes_refresh_tokens(app, db):
+    from datetime import datetime, timedelta, UTC
+    from sqlalchemy import func, select
+    from app.sqlalchemy_models.token import RefreshToken
+    from app.sqlalchemy_models.user import User
+
+    user = await User.create(db, "refreshuser", "Refresh User", "refreshuser@example.com")
+    await RefreshToken.issue(db, user.id, datetime.now(UTC) + timedelta(days=1))
+    await User.delete(db, user.id)
+    count = select(func.count()).select_from(RefreshToken).where(RefreshToken.user_id == user.id)
+    assert await db.scalar(count) == 0
+
+
+@pytest.mark.asyncio
+async def test_login_attempts_are_rate_limited_before_hashing(app):
+    from app.services.password import password_hasher
+    from app.services.ratelimit import login_limiter
+
+    login_limiter.configure(username_capacity=1, username_refill_per_second=0.01)
+    try:
+        async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+            response = await client.post('/api/auth/token', data={"username": "testuser1", "password": "wrong"})
+            assert response.status_code == 401
+
+            hashed = password_hasher.stats()['completed']
+            response = await client.post('/api/auth/token', data={"username": "testuser1", "password": "wrong"})
+            assert response.status_code == 429
+            assert response.json() == {'detail': 'Too many login attempts, try again later'}
+            assert response.headers['Retry-After'] == '100'
+            assert password_hasher.stats()['completed'] == hashed
+
+            response = await client.get('/api/stats/auth')
+            assert response.json()['login_limiter'] == {'allowed': 1, 'rejected_ip': 0, 'rejected_username': 1}
+    finally:
+        login_limiter.configure()
+
+
+@pytest.mark.asyncio
+async def test_login_ip_limit_behind_trusted_proxy(app):
+    from app.services.ratelimit import login_limiter
+
+    login_limiter.configure(ip_capacity=1, ip_refill_per_second=0.01, trusted_proxies=["127.0.0.1"])
+    try:
+        async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+            # Each forwarded client has its own bucket
+            for ip in ("203.0.113.1", "203.0.113.2"):
+                response = await client.post('/api/auth/token', data={"username": "testuser1", "password": "wrong"},
+                                             headers={"X-Forwarded-For": ip})
+                assert response.status_code == 401
+            response = await client.post('/api/auth/token', data={"username": "testuser1", "password": "wrong"},
+                                         headers={"X-Forwarded-For": "203.0.113.1"})
+            assert response.status_code == 429
+    finally:
+        login_limiter.configure()
+
+
+@pytest.mark.asyncio
+async def test_jwks_lists_no_shared_secret(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.get('/api/auth/jwks')
+    assert response.status_code == 200
+    assert response.json() == {'keys': []}
+    assert response.headers['Cache-Control'] == 'public, max-age=60'
+
+
+@pytest.mark.asyncio
+async def test_cached_tokens_of_a_removed_key_are_refused(app, tmp_path):
+    import json
+    import os
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+    from app.services.keys import keyring
+
+    def write_keyset(kid, mtime):
+        private_key = ed25519.Ed25519PrivateKey.generate().private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+        (tmp_path / f"{kid}.pem").write_bytes(private_key)
+        keyset = tmp_path / "keys.json"
+        keyset.write_text(json.dumps({"signing_kid": kid, "keys": [
+            {"kid": kid, "algorithm": "EdDSA", "private_key_file": f"{kid}.pem"}]}))
+        os.utime(keyset, (mtime, mtime))
+        return str(keyset)
+
+    config = get_config()
+    keyring.configure(None, file=write_keyset("old", 1000), reload_seconds=0)
+    try:
+        async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+            response = await client.put('/api/users/activate/1')
+            assert response.status_code == 200
+            response = await client.post('/api/auth/token', data={"username": "testuser1", "password": "test!wer1"})
+            headers = {'Authorization': 'Bearer ' + response.json()['access_token']}
+            response = await client.get('/api/auth/me', headers=headers)
+            assert response.status_code == 200
+
+            # The old key is removed, the token it signed is cached but refused
+            write_keyset("new", 2000)
+            response = await client.get('/api/auth/me', headers=headers)
+            assert response.status_code == 401
+
+            response = await client.put('/api/users/deactivate/1')
+            assert response.status_code == 200
+    finally:
+        keyring.configure(config.get('secret_key'), config.get('algorithm', 'HS256'), **config.get('token_keys', {}))
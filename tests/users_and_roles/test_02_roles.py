@@ -1,5 +1,6 @@
 import pytest
 from httpx import AsyncClient
+from uuid import uuid4
 from ..utils import remove_uuid
 
 
@@ -155,6 +156,11 @@ async def test_get_role_by_uuid(app):
 
     # Test gettting a non-existing role by uuid
     async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
-        response = await client.get('/api/roles/uuid/1231230123=102311-132')
+        response = await client.get('/api/roles/uuid/' + str(uuid4()))
     assert response.status_code == 400
     assert response.json() == {'detail': 'Role not found'}
+
+    # Test gettting a role by a malformed uuid
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.get('/api/roles/uuid/1231230123=102311-132')
+    assert response.status_code == 422
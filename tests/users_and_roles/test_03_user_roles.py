@@ -1,7 +1,14 @@
+import csv
+import io
+import json
 import pytest
 import pytest_asyncio
+from fastapi import HTTPException, Request
 from httpx import AsyncClient
 
+from app.services.database import sessionmanager
+from ..utils import count_queries
+
 
 def test_app_title(app):
     assert app.title == "testing"
@@ -177,3 +184,202 @@ async def test_remove_nonexistant_user_from_role(app):
         response = await client.delete(f'/api/users/88/role/1')
     assert response.status_code == 400
     assert response.json() == {"detail": "User not found"}
+
+
+@pytest.mark.asyncio
+async def test_export_users_with_roles(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.get('/api/users/export', params={'include_roles': True})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    users = [json.loads(line) for line in response.text.splitlines()]
+    assert [user['id'] for user in users] == sorted(user['id'] for user in users)
+    assert {user['username']: user['roles'] for user in users}['testuser2'] == ['super_user']
+
+
+@pytest.mark.asyncio
+async def test_export_roles_as_csv(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.get('/api/roles/export', params={'format': 'csv', 'include_users': True})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/csv')
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert {row['name']: row['users'] for row in rows}['super_user'] == 'testuser2'
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_users(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.post('/api/users/bulk', json=[
+            {'username': 'bulkuser1', 'email': 'bulkuser1@example.com', 'full_name': 'First Bulk User'},
+            {'username': 'bulkuser4', 'email': 'TestUser2@example.com', 'full_name': 'Second Test User'},
+            {'username': 'bulkuser2', 'email': 'bulkuser2@example.com', 'full_name': 'Second Bulk User'},
+            {'username': 'bulkuser3', 'email': 'bulkuser2@example.com', 'full_name': 'Third Bulk User'},
+            {'username': 'testuser2', 'email': 'bulkuser5@example.com', 'full_name': 'Fifth Bulk User'},
+        ])
+    assert response.status_code == 200
+    results = response.json()
+    assert [result['index'] for result in results] == [0, 1, 2, 3, 4]
+    assert results[0]['user']['username'] == 'bulkuser1'
+    assert results[1] == {'index': 1, 'user': None, 'detail': 'User with that email already exists'}
+    assert results[2]['user']['username'] == 'bulkuser2'
+    assert results[3] == {'index': 3, 'user': None, 'detail': 'User with that email already exists'}
+    assert results[4] == {'index': 4, 'user': None, 'detail': 'User with that username already exists'}
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.get('/api/users/username/bulkuser2')
+    assert response.status_code == 200
+    assert response.json()['id'] == results[2]['user']['id']
+
+
+@pytest.mark.asyncio
+async def test_bulk_assign_and_revoke_users_for_role(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.post('/api/roles/1/users', json={'user_ids': [1, 3, 99, 1]})
+        assert response.status_code == 200
+        assert response.json() == [
+            {'user_id': 1, 'role_id': 1, 'detail': 'User added to role'},
+            {'user_id': 3, 'role_id': 1, 'detail': 'User added to role'},
+            {'user_id': 99, 'role_id': 1, 'detail': 'User not found'},
+        ]
+
+        response = await client.post('/api/users/1/roles', json={'role_ids': [1, 2, 88]})
+        assert response.status_code == 200
+        assert response.json() == [
+            {'user_id': 1, 'role_id': 1, 'detail': 'User -> Role association already exists'},
+            {'user_id': 1, 'role_id': 2, 'detail': 'User added to role'},
+            {'user_id': 1, 'role_id': 88, 'detail': 'Role not found'},
+        ]
+
+        response = await client.get('/api/users/1/roles')
+        assert [role['id'] for role in response.json()['roles']] == [1, 2]
+
+        response = await client.post('/api/users/1/roles/revoke', json={'role_ids': [1, 2]})
+        assert response.status_code == 200
+        assert [result['detail'] for result in response.json()] == ['User removed from role'] * 2
+
+        response = await client.post('/api/roles/1/users/revoke', json={'user_ids': [1, 3]})
+        assert response.status_code == 200
+        assert response.json() == [
+            {'user_id': 1, 'role_id': 1, 'detail': 'User - Role association does not exist'},
+            {'user_id': 3, 'role_id': 1, 'detail': 'User removed from role'},
+        ]
+
+
+@pytest.mark.asyncio
+async def test_role_deleted_during_assignment_is_not_found(tmp_path, monkeypatch):
+    from sqlalchemy import event
+    from app.services.database import DatabaseSessionManager
+    from app.sqlalchemy_models import user as models
+
+    manager = DatabaseSessionManager()
+    manager.init(f"sqlite+aiosqlite:///{tmp_path}/assign.db", "testing")
+
+    # SQLite checks foreign keys only when asked to, as PostgreSQL always does
+    @event.listens_for(manager._engine.sync_engine, "connect")
+    def enable_foreign_keys(connection, record):
+        connection.execute("PRAGMA foreign_keys=ON")
+
+    try:
+        async with manager.connect() as connection:
+            await manager.create_all(connection)
+        async with manager.session() as session:
+            user = await models.User.create(session, "assignuser", "Assign User", "assignuser@example.com")
+            role = await models.Role.create(session, "Assign Role", "Deleted during the assignment")
+
+        existing_ids = models.existing_ids
+        checks = []
+
+        async def delete_role_after_check(db, user_ids, role_ids):
+            found = await existing_ids(db, user_ids, role_ids)
+            checks.append(found)
+            if len(checks) == 1:
+                async with manager.session() as other:
+                    await models.Role.delete(other, role.id)
+            return found
+
+        monkeypatch.setattr(models, "existing_ids", delete_role_after_check)
+        async with manager.session() as session:
+            results = await models.User.assign_roles(session, user.id, [role.id])
+        assert len(checks) == 2
+        assert results == [(user.id, role.id, "Role not found")]
+    finally:
+        await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_current_user_roles_follow_role_changes(app):
+    # Imported here, the module reads the config the app fixture loads
+    from app.views.auth import get_current_user, get_current_active_user, get_current_user_roles, require_roles
+
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.put('/api/users/activate/1')
+        assert response.status_code == 200
+        response = await client.post('/api/auth/token', data={
+            "username": "testuser1",
+            "password": "test!wer1"
+        })
+        headers = {'Authorization': 'Bearer ' + response.json()['access_token']}
+
+        response = await client.get('/api/auth/me/roles', headers=headers)
+        assert response.status_code == 200
+        assert response.json() == []
+
+        response = await client.post('/api/users/1/role/1')
+        assert response.status_code == 201
+        response = await client.get('/api/auth/me/roles', headers=headers)
+        assert response.json() == ['admin']
+
+        with count_queries(sessionmanager._engine) as statements:
+            current_user = await get_current_active_user(await get_current_user(
+                Request({"type": "http", "path": "/", "headers": []}), headers['Authorization'][7:]))
+            assert await require_roles('admin')(current_user, await get_current_user_roles(current_user))
+            with pytest.raises(HTTPException) as error:
+                await require_roles('admin', 'auditor')(current_user, await get_current_user_roles(current_user))
+            assert error.value.status_code == 403
+        assert statements == []
+
+        response = await client.put('/api/roles/1', json={'name': 'administrator'})
+        assert response.status_code == 200
+        response = await client.get('/api/auth/me/roles', headers=headers)
+        assert response.json() == ['administrator']
+
+        response = await client.put('/api/roles/1', json={'name': 'admin'})
+        response = await client.delete('/api/users/1/role/1')
+        assert response.status_code == 200
+        response = await client.get('/api/auth/me/roles', headers=headers)
+        assert response.json() == []
+
+        response = await client.put('/api/users/deactivate/1')
+        assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_get_roles_paginated(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        async def walk(**params):
+            ids, pages, after = [], 0, None
+            while True:
+                page_params = {**params, 'limit': 1, **({'after': after} if after else {})}
+                response = await client.get('/api/roles/', params=page_params)
+                assert response.status_code == 200
+                ids += [role['id'] for role in response.json()]
+                pages += 1
+                assert pages <= 10, ids
+                after = response.headers.get('X-Next-Cursor')
+                if after is None:
+                    return ids, pages
+                assert after == str(ids[-1])
+
+        response = await client.get('/api/roles/')
+        assert 'X-Next-Cursor' not in response.headers
+        all_ids = [role['id'] for role in response.json()]
+        assert len(all_ids) >= 2
+
+        # Every role once, in order, and no cursor after the last page
+        assert await walk() == (all_ids, len(all_ids))
+
+        response = await client.get('/api/roles/', params={'name_prefix': 'super'})
+        super_ids = [role['id'] for role in response.json()]
+        assert super_ids
+        assert (await walk(name_prefix='super'))[0] == super_ids
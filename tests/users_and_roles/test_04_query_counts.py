@@ -0,0 +1,54 @@
+import pytest
+from httpx import AsyncClient
+
+from app.services.database import sessionmanager
+from app.sqlalchemy_models.user import User, Role, lookup_statement
+from ..utils import count_queries
+
+
+# Number of SQL statements each read endpoint may issue. Plain User and Role
+# responses load no relationships, the *WithRoles / *WithUsers responses load
+# exactly one level with a single selectin query.
+@pytest.mark.asyncio
+@pytest.mark.parametrize("url, expected", [
+    ('/api/users/', 1),
+    ('/api/users/1', 1),
+    ('/api/users/username/testuser1', 1),
+    ('/api/users/4/roles', 2),
+    ('/api/users/export?include_roles=true', 1),
+    ('/api/roles/', 1),
+    ('/api/roles/2', 1),
+    ('/api/roles/2/users', 2),
+    ('/api/roles/export?include_users=true', 1),
+])
+async def test_query_count(app, url, expected):
+    with count_queries(sessionmanager._engine) as statements:
+        async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+            response = await client.get(url)
+    assert response.status_code == 200
+    assert len(statements) == expected, statements
+
+
+@pytest.mark.asyncio
+async def test_role_with_users_loads_one_level(app):
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as client:
+        response = await client.get('/api/roles/2/users')
+    assert response.status_code == 200
+    assert [user['username'] for user in response.json()['users']] == ['testuser2']
+    assert 'roles' not in response.json()['users'][0]
+
+
+@pytest.mark.asyncio
+async def test_single_row_lookups_issue_one_limited_query(app, db):
+    user = await User.get_user_by_username(db, 'testuser1')
+    role = await Role.get(db, 1)
+    with count_queries(sessionmanager._engine) as statements:
+        for _ in range(3):
+            assert (await User.get(db, user.id)).id == user.id
+            assert (await User.get_user_by_uuid(db, user.uuid)).id == user.id
+            assert (await User.get_user_by_username(db, user.username)).id == user.id
+            assert (await Role.get_role_by_uuid(db, role.uuid)).id == role.id
+    assert len(statements) == 12, statements
+    assert all("LIMIT" in statement for statement in statements), statements
+    # The statements are built once and reused
+    assert lookup_statement(User, "uuid") is lookup_statement(User, "uuid")
@@ -0,0 +1,67 @@
+import pytest
+from uuid import uuid4
+from sqlalchemy import event
+
+from app.services.database import sessionmanager
+from app.sqlalchemy_models.user import User, Role
+
+
+# The lookups on the authentication path must be index scans. The statements
+# the model methods send are captured and explained as they are. On
+# PostgreSQL sequential scans are switched off for the EXPLAIN, so that the
+# planner picks an index whenever one applies, even though the test tables
+# are tiny.
+AUTH_PATH_LOOKUPS = [
+    ("username", lambda db: User.get_user_by_username(db, 'testuser1'), "ix_users_username"),
+    ("email", lambda db: User.get_user_by_email(db, 'TestUser1@example.com'), "ix_users_email_lower"),
+    # The selectin load of Role.users is the statement that goes through role_id
+    ("role_id", lambda db: Role.get(db, 2, with_users=True), "ix_user_role_association_role_id"),
+]
+
+
+async def last_statement(db, lookup):
+    """Run a model lookup and return the last statement it sent, with its parameters."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(sessionmanager._engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        await lookup(db)
+    except ValueError:
+        # Not found, the statement was still sent
+        pass
+    finally:
+        event.remove(sessionmanager._engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    return statements[-1]
+
+
+async def explain(db, statement, parameters):
+    connection = await db.connection()
+    if connection.dialect.name == "postgresql":
+        await connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        rows = (await connection.exec_driver_sql("EXPLAIN " + statement, parameters)).all()
+        return "\n".join(row[0] for row in rows)
+    rows = (await connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name, lookup, index", AUTH_PATH_LOOKUPS, ids=[lookup[0] for lookup in AUTH_PATH_LOOKUPS])
+async def test_lookup_uses_index(db, name, lookup, index):
+    plan = await explain(db, *await last_statement(db, lookup))
+    assert index in plan, plan
+    assert "Seq Scan" not in plan and "SCAN users" not in plan, plan
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("lookup, table", [
+    (lambda db: User.get_user_by_uuid(db, uuid4()), "users"),
+    (lambda db: Role.get_role_by_uuid(db, uuid4()), "roles"),
+], ids=["users", "roles"])
+async def test_uuid_lookup_uses_unique_index(db, lookup, table):
+    # The unique constraint's index is named by the database
+    plan = await explain(db, *await last_statement(db, lookup))
+    assert "INDEX" in plan.upper(), plan
+    assert "Seq Scan" not in plan and f"SCAN {table}" not in plan, plan
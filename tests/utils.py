@@ -1,5 +1,7 @@
+import contextlib
 
 from passlib.context import CryptContext
+from sqlalchemy import event
 
 
 def remove_uuid(response_json):
@@ -11,3 +13,18 @@ def get_password_hash(password):
     pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     password_hash = pwd_context.hash(password)
     print(password_hash)
+
+
+@contextlib.contextmanager
+def count_queries(engine):
+    """Collect the SQL statements executed on an engine inside the block."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)